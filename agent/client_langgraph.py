@@ -1,35 +1,242 @@
+import argparse
 import asyncio
+import hashlib
+import json
+import time
 from langchain_mcp_adapters.client import MultiServerMCPClient
+from langchain_mcp_adapters.tools import load_mcp_tools
+from langgraph.errors import GraphRecursionError
 from langgraph.prebuilt import create_react_agent
 from langchain_openai import ChatOpenAI # Assuming you use OpenAI LLM
 import os
 
+MCP_SERVERS = {
+    "my_tools": {
+        "transport": "streamable_http", # Or "streamable_http" and URL for HTTP server
+        "url": "http://localhost:8080/mcp", # If using HTTP transport
+    }
+}
 
-async def run_agent(repo_path):
-    # Initialize the MCP client, pointing to your server's transport and URL
-    client = MultiServerMCPClient(
-        {
-            "my_tools": {
-                "transport": "streamable_http", # Or "streamable_http" and URL for HTTP server
-                "url": "http://localhost:8080/mcp", # If using HTTP transport
-            }
-        }
-    )
-
-    # Get the tools exposed by your MCP server
-    tools = await client.get_tools()
-    print(tools)
-
-    # Create a LangGraph agent with the LLM and the MCP tools
-    llm = ChatOpenAI(model="gpt-4", api_key=os.getenv("OPENAI_API_KEY"))
+# Sections of the report, each answered by its own sub-agent, all running at once
+SECTIONS = {
+    "Architecture": "What is the general architecture of this repo {repo_path}?",
+    "Major Classes": "List all major classes of the repo {repo_path} and their purposes.",
+    "External Libraries": "What external libraries or frameworks does the repo {repo_path} use?",
+    "Design Patterns": "Are there any design patterns used in the repo {repo_path}?",
+    "Services": "What are the main services of the repo {repo_path} and how do they interact?",
+}
+
+# Tool calls each sub-agent may make before it must answer; a ReAct round is two graph steps (model, tools)
+AGENT_TOOL_CALLS = int(os.getenv("AGENT_TOOL_CALLS", "10"))
+
+
+async def run_section(llm, tools, title, question):
     agent = create_react_agent(llm, tools)
+    start_time = time.perf_counter()
+    try:
+        response = await agent.ainvoke({"messages": question}, config={"recursion_limit": 2 * AGENT_TOOL_CALLS + 1})
+        answer = response["messages"][-1].content
+    except GraphRecursionError:
+        answer = f"_No answer within {AGENT_TOOL_CALLS} tool calls._"
+    print(f"{title}: {time.perf_counter() - start_time:.1f}s")
+    return answer
+
+
+async def run_agent(repo_path, output_path="report.md"):
+    # Initialize the MCP client, pointing to your server's transport and URL
+    client = MultiServerMCPClient(MCP_SERVERS)
+
+    start_time = time.perf_counter()
+    # One MCP session shared by all the sub-agents, instead of a new connection per tool call
+    async with client.session("my_tools") as session:
+        tools = await load_mcp_tools(session)
+        print(tools)
+
+        # Create a LangGraph agent per section with the LLM and the MCP tools, and run them concurrently
+        llm = ChatOpenAI(model="gpt-4", api_key=os.getenv("OPENAI_API_KEY"))
+        answers = await asyncio.gather(*(
+            run_section(llm, tools, title, question.format(repo_path=repo_path))
+            for title, question in SECTIONS.items()
+        ))
+    print(f"Report: {time.perf_counter() - start_time:.1f}s")
+
+    report = [f"# {os.path.basename(os.path.abspath(repo_path))}"]
+    report.extend(f"## {title}\n\n{answer}" for title, answer in zip(SECTIONS, answers))
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write("\n\n".join(report) + "\n")
+    print(f"Wrote {output_path}")
+
+
+# Map-reduce mode: every file is summarized on its own, then each directory from the summaries of its children,
+# up to the repository. Summaries are cached in AGENT_SUMMARY_CACHE, files by the hash of their path and content and
+# directories by the hash of their children's keys, so a re-run only re-summarizes what changed and the directories above.
+AGENT_SUMMARY_CACHE = os.getenv("AGENT_SUMMARY_CACHE", "summary_cache.json")
+AGENT_SUMMARY_CONCURRENCY = int(os.getenv("AGENT_SUMMARY_CONCURRENCY", "8"))
+# Summaries reduced per completion; directories with more children are reduced in groups first
+AGENT_REDUCE_FANIN = int(os.getenv("AGENT_REDUCE_FANIN", "20"))
+# Longer files are summarized from their first and last lines, cut by the read_file tool
+AGENT_FILE_MAX_TOKENS = int(os.getenv("AGENT_FILE_MAX_TOKENS", "4000"))
+# Bump whenever the prompts below change, so cached summaries are not reused
+SUMMARY_PROMPT_VERSION = 1
+
+FILE_PROMPT = "Summarize the file {path} of a code repository in a few sentences: its purpose, main classes and functions, and what it depends on.\n\n{content}"
+DIRECTORY_PROMPT = "Summarize the directory {path} of a code repository in one paragraph, from the summaries of its files and subdirectories:\n\n{summaries}"
+REPORT_PROMPT = ("Write a Markdown report of the repository {path} from the summaries of its top-level files and directories, "
+                 "with the sections: {sections}.\n\n{summaries}")
+
+
+def content_key(*parts) -> str:
+    digest = hashlib.sha256(str(SUMMARY_PROMPT_VERSION).encode("utf-8"))
+    for part in parts:
+        digest.update(b"\0" + part.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def load_summary_cache(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_summary_cache(path, cache):
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(cache, f)
+    os.replace(path + ".tmp", path)
+
+
+class Summarizer:
+    def __init__(self, llm, session, cache):
+        self.llm = llm
+        self.session = session
+        self.cache = cache
+        self.semaphore = asyncio.Semaphore(max(1, AGENT_SUMMARY_CONCURRENCY))
+        self.completions = 0
+
+    async def call_tool(self, name, arguments):
+        """The tool's JSON result, or {"error": message} if the call failed."""
+        try:
+            async with self.semaphore:
+                result = await self.session.call_tool(name, arguments)
+        except Exception as e:
+            return {"error": f"{name} failed: {e}"}
+        text = result.content[0].text if result.content else ""
+        # is_error in MCP SDK v2, isError before
+        is_error = getattr(result, "is_error", None)
+        if is_error is None:
+            is_error = getattr(result, "isError", False)
+        if is_error:
+            return {"error": text or f"{name} failed"}
+        try:
+            return json.loads(text)
+        except ValueError:
+            return {"error": f"{name} returned invalid JSON: {text[:200]}"}
+
+    async def complete(self, key, prompt):
+        """Completion of the prompt, from the cache if one was made for this key before."""
+        if key not in self.cache:
+            async with self.semaphore:
+                response = await self.llm.ainvoke(prompt)
+            self.cache[key] = response.content
+            self.completions += 1
+        return self.cache[key]
+
+    async def list_files(self, repo_path):
+        files, cursor = [], None
+        while True:
+            page = await self.call_tool("list_files", {"repo_path": repo_path, "cursor": cursor})
+            if "error" in page:
+                raise RuntimeError(page["error"])
+            files.extend(page["files"])
+            cursor = page.get("next_cursor")
+            if not cursor:
+                return files
+
+    async def summarize_file(self, repo_path, path):
+        """(key, summary) of a file, or None for an empty, binary or unreadable file."""
+        result = await self.call_tool("read_file", {"repo_path": repo_path, "file_path": path,
+                                                    "max_tokens": AGENT_FILE_MAX_TOKENS})
+        if "error" in result:
+            print(f"Skipping {path}: {result['error']}")
+            return None
+        content = result.get("content")
+        if not content or not content.strip() or "\x00" in content:
+            return None
+        # The prompt names the file, so identical files at different paths get their own summaries
+        key = content_key("file", path, content)
+        return key, await self.complete(key, FILE_PROMPT.format(path=path, content=content))
+
+    async def reduce(self, path, children, prompt=DIRECTORY_PROMPT, **fields):
+        """(key, summary) of a directory from its children's (name, key, summary), reduced AGENT_REDUCE_FANIN at a time."""
+        while len(children) > AGENT_REDUCE_FANIN:
+            groups = [children[i:i + AGENT_REDUCE_FANIN] for i in range(0, len(children), AGENT_REDUCE_FANIN)]
+            reduced = await asyncio.gather(*(self.reduce(path, group) for group in groups))
+            children = [(f"part {number}", key, summary) for number, (key, summary) in enumerate(reduced, 1)]
+        key = content_key(prompt, path, *fields.values(), *(f"{name}={key}" for name, key, _ in children))
+        summaries = "\n\n".join(f"{name}: {summary}" for name, _, summary in children)
+        return key, await self.complete(key, prompt.format(path=path, summaries=summaries, **fields))
+
+    async def summarize_directory(self, repo_path, path, tree):
+        """
+        (key, summary) of a directory of the tree, its subdirectories and files summarized concurrently, or None if
+        it has nothing to summarize. For the root ("") the children are returned, for the caller to reduce into the report.
+        """
+        subdirs = sorted(name for name, child in tree.items() if isinstance(child, dict))
+        files = sorted(name for name, child in tree.items() if not isinstance(child, dict))
+        results = await asyncio.gather(
+            *(self.summarize_directory(repo_path, f"{path}/{name}" if path else name, tree[name]) for name in subdirs),
+            *(self.summarize_file(repo_path, tree[name]) for name in files),
+        )
+        children = [(name + "/" if name in subdirs else name, *result)
+                    for name, result in zip(subdirs + files, results) if result is not None]
+        if not children:
+            return None
+        if not path:
+            return children
+        return await self.reduce(path, children)
+
+
+def build_tree(files):
+    """Nested dicts of directory name -> subtree, with the relative path of each file at its leaf."""
+    tree = {}
+    for path in files:
+        node = tree
+        *dirs, name = path.split("/")
+        for directory in dirs:
+            node = node.setdefault(directory, {})
+        node[name] = path
+    return tree
+
+
+async def run_map_reduce(repo_path, output_path="report.md"):
+    client = MultiServerMCPClient(MCP_SERVERS)
+    cache = load_summary_cache(AGENT_SUMMARY_CACHE)
+    start_time = time.perf_counter()
+    async with client.session("my_tools") as session:
+        llm = ChatOpenAI(model="gpt-4", api_key=os.getenv("OPENAI_API_KEY"))
+        summarizer = Summarizer(llm, session, cache)
+        try:
+            files = await summarizer.list_files(repo_path)
+            children = await summarizer.summarize_directory(repo_path, "", build_tree(files)) or []
+            name = os.path.basename(os.path.abspath(repo_path))
+            _, report = await summarizer.reduce(name, children, prompt=REPORT_PROMPT, sections=", ".join(SECTIONS))
+        finally:
+            # Keep the summaries made so far, even if the run fails part way
+            save_summary_cache(AGENT_SUMMARY_CACHE, cache)
+    print(f"Summarized {len(files)} files with {summarizer.completions} completions "
+          f"in {time.perf_counter() - start_time:.1f}s")
 
-    # Invoke the agent
-    response = await agent.ainvoke({"messages": f"What is the general architecture of this repo {repo_path}?, List all major classes and their purposes. What external libraries or frameworks does this repo use?, Are there any design patterns used in this repo?, What are the main services and how do they interact?"})
-    print(response["messages"][-1].content)
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(report.strip() + "\n")
+    print(f"Wrote {output_path}")
 
 
 if __name__ == "__main__":
-    repo_path = "./grip-repo"
+    parser = argparse.ArgumentParser(description="Write report.md about a repository")
+    parser.add_argument("repo_path", nargs="?", default="./grip-repo")
+    parser.add_argument("--map-reduce", action="store_true",
+                        help="Summarize every file, then every directory, instead of asking the report questions")
+    args = parser.parse_args()
 
-    asyncio.run(run_agent(repo_path))
\ No newline at end of file
+    asyncio.run(run_map_reduce(args.repo_path) if args.map_reduce else run_agent(args.repo_path))
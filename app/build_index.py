@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Build a repository index offline and write it to a prebuilt index file,
+so MCP server nodes can load it at startup instead of re-embedding the repo.
+
+Usage:
+  python -m app.build_index build <repo_path> -o <index_file>
+  python -m app.build_index inspect <index_file>
+"""
+
+import argparse
+import json
+import time
+from app.index_builder import get_chunks_for_repo
+from app.index_store import save_index, read_index_header
+from app.usage import attribute, get_usage
+
+
+def build(repo_path: str, output_path: str):
+    start_time = time.time()
+    with attribute(repo_path, "build_index"):
+        chunks = get_chunks_for_repo(repo_path)
+    header = save_index(chunks, output_path, repo_path)
+    usage = get_usage(repo_path=repo_path)["usage"]
+    print(f"Indexed {len(chunks)} chunks in {time.time() - start_time:.2f} seconds")
+    print(f"Embedding tokens: {usage['embedding_tokens']}, estimated cost: ${usage['cost_usd']:.4f}")
+    print(f"Index written to: {output_path}")
+    print(json.dumps(header, indent=2))
+
+
+def inspect(index_path: str):
+    print(json.dumps(read_index_header(index_path), indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and inspect prebuilt repository indexes")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Index a repository into a prebuilt index file")
+    build_parser.add_argument("repo_path", help="Path to the repository to index")
+    build_parser.add_argument("-o", "--output", required=True, help="Path of the index file to write")
+
+    inspect_parser = subparsers.add_parser("inspect", help="Print the header of a prebuilt index file")
+    inspect_parser.add_argument("index_path", help="Path of the index file to inspect")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        build(args.repo_path, args.output)
+    else:
+        inspect(args.index_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# --- app/coalescing.py ---
+import asyncio
+import os
+from app.metrics import inc_counter
+
+# Set MCP_COALESCE=0 to give every request its own retrieval and completion
+COALESCE_ENABLED = os.getenv("MCP_COALESCE", "1") != "0"
+
+# Key -> future of the leader's (succeeded, result). Only touched from the event loop thread.
+_in_flight = {}
+
+
+def coalesce_key(repo_path: str, question: str, **settings):
+    """Identical requests: same repo after resolving symlinks, same question up to whitespace, same settings."""
+    return os.path.realpath(repo_path), " ".join(question.split()), tuple(sorted(settings.items()))
+
+
+async def coalesce(key, func):
+    """
+    Run the coroutine function func once for all concurrent callers with the same key.
+    The first caller (the leader) runs it and the others await its result. If the leader fails,
+    it raises its own error and the waiters race again, so one of them retries as the new leader.
+    """
+    if not COALESCE_ENABLED:
+        return await func()
+
+    while True:
+        flight = _in_flight.get(key)
+        if flight is None:
+            break
+        inc_counter("mcp_coalesced_total")
+        # Shielded, so a cancelled follower does not cancel the leader's flight
+        succeeded, result = await asyncio.shield(flight)
+        if succeeded:
+            return result
+        inc_counter("mcp_coalesce_retries_total")
+
+    flight = _in_flight[key] = asyncio.get_running_loop().create_future()
+    try:
+        result = await func()
+    except BaseException:
+        flight.set_result((False, None))
+        raise
+    else:
+        flight.set_result((True, result))
+        return result
+    finally:
+        del _in_flight[key]
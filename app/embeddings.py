@@ -0,0 +1,157 @@
+# --- app/embeddings.py ---
+import hashlib
+import os
+import re
+import zlib
+from typing import List
+from app.usage import record_usage
+from app.scheduler import call_openai, estimate_tokens
+
+
+class EmbeddingBackend:
+    """
+    Turns a batch of texts into embedding vectors.
+    `name` identifies the embedding space, so indexes built with one backend are never queried with another.
+    """
+    name = None
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+
+class OpenAIEmbeddingBackend(EmbeddingBackend):
+    def __init__(self, client, model: str, max_batch_size: int = 2048):
+        self.client = client
+        self.model = model
+        self.name = model
+        self.max_batch_size = max_batch_size
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        embeddings = []
+        for i in range(0, len(texts), self.max_batch_size):
+            batch = texts[i:i + self.max_batch_size]
+            response = call_openai(
+                self.client.embeddings.create,
+                sum(estimate_tokens(text) for text in batch),
+                input=batch,
+                model=self.model,
+            )
+            if response.usage is not None:
+                record_usage("embedding", self.model, prompt_tokens=response.usage.prompt_tokens)
+            embeddings.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+        return embeddings
+
+
+IDENTIFIER_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+SUBWORD_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+def split_identifiers(text: str) -> List[str]:
+    """
+    Lower-cased tokens of the text, with identifiers split on snake_case and camelCase boundaries.
+    Compound identifiers are also kept whole, e.g. "readme_for" -> ["readme_for", "readme", "for"].
+    """
+    tokens = []
+    for identifier in IDENTIFIER_RE.findall(text):
+        parts = SUBWORD_RE.findall(identifier)
+        if len(parts) > 1:
+            tokens.append(identifier.lower())
+        tokens.extend(part.lower() for part in parts)
+    return tokens
+
+
+class HashingEmbeddingBackend(EmbeddingBackend):
+    """
+    Deterministic local stand-in for a semantic embedding model: feature hashing of identifier-split
+    tokens with sublinear term frequency and L2 normalization. No network access, stable across runs.
+    """
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _bucket(self, token: str):
+        # Not cached: crc32 costs about as much as a dict lookup, and a cache of every token seen would grow forever
+        h = zlib.crc32(token.encode("utf-8"))
+        return h % self.dim, 1.0 if h & 0x80000000 else -1.0
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        import numpy as np
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts = {}
+            for token in split_identifiers(text):
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                column, sign = self._bucket(token)
+                matrix[row, column] += sign * (1.0 + np.log(count))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (matrix / norms).tolist()
+
+
+def model_fingerprint(model_path: str) -> str:
+    """Hash of the names and contents of every file of a model directory, so two different models never share a name."""
+    digest = hashlib.sha256()
+    for directory, subdirs, files in os.walk(model_path):
+        subdirs.sort()
+        for name in sorted(files):
+            full_path = os.path.join(directory, name)
+            digest.update(os.path.relpath(full_path, model_path).replace(os.sep, "/").encode("utf-8") + b"\0")
+            with open(full_path, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(block)
+    return digest.hexdigest()
+
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    """
+    Local encoder running on CPU through sentence-transformers, loaded from a local model directory,
+    so indexing and querying need no external API.
+    Texts are sorted by token length and grouped into batches whose padded size (batch size x longest
+    text) stays under max_batch_tokens, so short snippets are not padded to the length of whole files.
+    """
+    def __init__(self, model_path: str, num_threads: int = None, max_batch_tokens: int = 16384, max_batch_size: int = 64):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.model = SentenceTransformer(model_path, device="cpu")
+        # The directory name alone does not identify the model: add a hash of its files
+        model_path = os.path.normpath(model_path)
+        self.name = f"sentence-transformers/{os.path.basename(model_path)}@{model_fingerprint(model_path)[:16]}"
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+
+    def _token_lengths(self, texts: List[str]) -> List[int]:
+        encoded = self.model.tokenizer(texts, truncation=True, max_length=self.model.max_seq_length)
+        return [len(input_ids) for input_ids in encoded["input_ids"]]
+
+    def _make_batches(self, lengths: List[int]) -> List[List[int]]:
+        order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+        batches, batch = [], []
+        for i in order:
+            # Sorted longest first, so the first text of a batch sets its padded length
+            padded_length = lengths[batch[0]] if batch else lengths[i]
+            if batch and (len(batch) >= self.max_batch_size or (len(batch) + 1) * padded_length > self.max_batch_tokens):
+                batches.append(batch)
+                batch = []
+            batch.append(i)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        embeddings = [None] * len(texts)
+        for batch in self._make_batches(self._token_lengths(texts)):
+            vectors = self.model.encode(
+                [texts[i] for i in batch],
+                batch_size=len(batch),
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False,
+            )
+            for i, vector in zip(batch, vectors):
+                embeddings[i] = vector.tolist()
+        return embeddings
@@ -0,0 +1,139 @@
+# --- app/file_reader.py ---
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from app.repo_files import file_cache, is_binary
+
+# Whole-file reads larger than this return metadata and the first lines instead; ranges are cut at this size
+READ_FILE_MAX_BYTES = int(os.getenv("MCP_READ_FILE_MAX_BYTES", str(256 * 1024)))
+# Newlines are located this many bytes at a time, and only as far as the requested lines
+LINE_SCAN_BLOCK_BYTES = 1024 * 1024
+MAX_CACHED_LINE_INDEXES = 64
+
+
+class LineIndex:
+    """
+    Byte offsets of the starts of a file's lines, extended only as far as the lines asked for so far.
+    Shared by concurrent readers: extend it through lines(), which holds the index's lock.
+    """
+    def __init__(self, size: int):
+        import numpy as np
+        self.size = size
+        self.starts = np.zeros(1, dtype=np.int64)
+        self.scanned_to = 0
+        self.lock = threading.Lock()
+
+    @property
+    def complete(self) -> bool:
+        return self.scanned_to >= self.size
+
+    def ensure(self, data, line: int):
+        """Scan until the start of line (1-based) is known, or the end of the file."""
+        import numpy as np
+        blocks = []
+        known = len(self.starts)
+        while known < line and self.scanned_to < self.size:
+            end = min(self.scanned_to + LINE_SCAN_BLOCK_BYTES, self.size)
+            newlines = np.flatnonzero(np.frombuffer(data[self.scanned_to:end], dtype=np.uint8) == 10)
+            blocks.append(newlines + self.scanned_to + 1)
+            known += len(newlines)
+            self.scanned_to = end
+        if blocks:
+            self.starts = np.concatenate([self.starts] + blocks)
+            # A final newline does not start another line
+            if self.complete and self.starts[-1] == self.size:
+                self.starts = self.starts[:-1]
+
+    def lines(self, data, line: int):
+        """(line starts, complete) once the start of line is known; the array returned is never changed afterwards."""
+        with self.lock:
+            self.ensure(data, line)
+            return self.starts, self.complete
+
+
+_line_indexes = OrderedDict()
+_line_indexes_lock = threading.Lock()
+
+
+def _get_line_index(full_path: str, mtime_ns: int, size: int) -> LineIndex:
+    key = (os.path.abspath(full_path), mtime_ns, size)
+    with _line_indexes_lock:
+        index = _line_indexes.get(key)
+        if index is None:
+            index = _line_indexes[key] = LineIndex(size)
+            if len(_line_indexes) > MAX_CACHED_LINE_INDEXES:
+                _line_indexes.popitem(last=False)
+        else:
+            _line_indexes.move_to_end(key)
+        return index
+
+
+def _decode(data) -> str:
+    return bytes(data).decode("utf-8", errors="replace")
+
+
+def read_file_range(full_path: str, start_line: int = None, end_line: int = None, byte_offset: int = None,
+                    byte_length: int = None, max_bytes: int = None) -> dict:
+    """
+    Read a file, a range of lines (1-based, inclusive) or a range of bytes, never returning more than max_bytes
+    of content. A whole-file read of a larger file returns its size and first lines, flagged "truncated".
+    Small files come from the shared file cache, larger ones through mmap; only the part of the file up to
+    the requested range is scanned for line starts.
+    """
+    max_bytes = READ_FILE_MAX_BYTES if max_bytes is None else max_bytes
+    mtime_ns, size = file_cache.stat(full_path)
+    if size <= file_cache.max_file_bytes:
+        data = file_cache.read_bytes(full_path)
+        return _read_range(data, full_path, mtime_ns, start_line, end_line, byte_offset, byte_length, max_bytes)
+    with open(full_path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _read_range(mm, full_path, mtime_ns, start_line, end_line, byte_offset, byte_length, max_bytes)
+
+
+def _read_range(data, full_path: str, mtime_ns: int, start_line: int, end_line: int, byte_offset: int,
+                byte_length: int, max_bytes: int) -> dict:
+    """read_file_range over the file's bytes or mmap, which support the same slicing and searching."""
+    size = len(data)
+    result = {"size": size, "mtime": mtime_ns / 1e9}
+    if size == 0:
+        return dict(result, content="")
+    if is_binary(data):
+        raise ValueError(f"Binary file: {full_path}")
+    if byte_offset is not None or byte_length is not None:
+        start = min(max(byte_offset or 0, 0), size)
+        length = size - start if byte_length is None else max(byte_length, 0)
+        end = min(start + min(length, max_bytes), size)
+        return dict(result, content=_decode(data[start:end]), byte_offset=start, byte_length=end - start,
+                    truncated=end < min(start + length, size))
+
+    if start_line is None and end_line is None:
+        if size <= max_bytes:
+            return dict(result, content=_decode(data[:]))
+        # Too large: the head of the file, cut at the last whole line
+        head_end = data.rfind(b"\n", 0, max_bytes) + 1 or max_bytes
+        return dict(result, content=_decode(data[:head_end]), truncated=True,
+                    end_line=data[:head_end].count(b"\n") or 1)
+
+    index = _get_line_index(full_path, mtime_ns, size)
+    start_line = max(start_line or 1, 1)
+    if end_line is not None:
+        end_line = max(end_line, start_line)
+    starts, complete = index.lines(data, start_line if end_line is None else end_line + 1)
+    if start_line > len(starts):
+        return dict(result, content="", start_line=start_line, end_line=start_line - 1, has_more=False)
+    start = int(starts[start_line - 1])
+    if end_line is not None and end_line < len(starts):
+        end = int(starts[end_line])
+    else:
+        end_line, end = None, size
+    truncated = end - start > max_bytes
+    if truncated:
+        # Cut at the last whole line that fits, or mid-line if even the first line is too long
+        end = data.rfind(b"\n", start, start + max_bytes) + 1 or start + max_bytes
+    last_line = start_line + data[start:end].count(b"\n") - (1 if data[end - 1:end] == b"\n" else 0)
+    result = dict(result, content=_decode(data[start:end]), start_line=start_line, end_line=last_line,
+                  start_byte=start, has_more=end < size, truncated=truncated)
+    if complete:
+        result["total_lines"] = len(starts)
+    return result
@@ -0,0 +1,114 @@
+# --- app/hedging.py ---
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from app.metrics import inc_counter
+from app.scheduler import set_cancel_event
+
+
+class LatencyTracker:
+    """Latencies of the most recent calls, to hedge after the currently observed p95."""
+    def __init__(self, window: int = 200):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def percentile(self, q: float, min_samples: int = 1):
+        """The q-th percentile (0-100) of the window, or None with fewer than min_samples calls."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies or len(latencies) < min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * q / 100))]
+
+
+# Runs the calls being raced. The sync OpenAI client cannot abort a request in flight: a losing call's
+# current request runs until it returns or its timeout passes, and its result is discarded. Its cancel event
+# is set, so app.scheduler does not send or retry any further request for it.
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(max_workers: int) -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedged-call")
+    return _executor
+
+
+def hedged_call(call, deadline: float = None, hedge_after: float = None, tracker: LatencyTracker = None,
+                max_workers: int = 32):
+    """
+    Call call(timeout) and return its result, where timeout is the seconds left before the deadline (or None).
+    If hedge_after seconds pass without an answer, fire a second identical call and take whichever
+    succeeds first. Raises TimeoutError when no call has succeeded by the deadline,
+    and the error of the last failed call when all calls fail.
+    """
+    executor = _get_executor(max_workers)
+    start_time = time.monotonic()
+
+    def remaining():
+        return None if deadline is None else deadline - (time.monotonic() - start_time)
+
+    def timed_call(timeout):
+        call_start = time.monotonic()
+        result = call(timeout)
+        return result, time.monotonic() - call_start
+
+    cancel_events = {}
+
+    def submit():
+        # Each call runs in a copy of the caller's context, so usage attribution and priority carry over
+        context = contextvars.copy_context()
+        event = threading.Event()
+        context.run(set_cancel_event, event)
+        future = executor.submit(context.run, timed_call, remaining())
+        cancel_events[future] = event
+        return future
+
+    def abandon(futures):
+        for future in futures:
+            future.cancel()
+            cancel_events[future].set()
+
+    pending = {submit()}
+    hedge = None
+    while True:
+        timeout = remaining()
+        if hedge is None and hedge_after is not None:
+            until_hedge = hedge_after - (time.monotonic() - start_time)
+            timeout = until_hedge if timeout is None else min(timeout, until_hedge)
+        if timeout is not None and timeout <= 0:
+            timeout = 0
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            if future.exception() is None:
+                abandon(pending)
+                result, latency = future.result()
+                if tracker is not None:
+                    tracker.record(latency)
+                if future is hedge:
+                    inc_counter("mcp_llm_hedge_wins_total")
+                return result
+            # A call that gave up on the deadline is not retried: the retry would have no more time
+            if not pending and (hedge is not None or hedge_after is None or isinstance(future.exception(), TimeoutError)):
+                raise future.exception()
+
+        if deadline is not None and remaining() <= 0:
+            abandon(pending)
+            inc_counter("mcp_llm_deadline_exceeded_total")
+            raise TimeoutError(f"No answer within {deadline} seconds")
+
+        hedge_due = hedge_after is not None and time.monotonic() - start_time >= hedge_after
+        if hedge is None and (hedge_due or not pending):
+            # Hedge when the first call is slow, or retry once right away when it failed before the hedge was due
+            hedge = submit()
+            pending.add(hedge)
+            inc_counter("mcp_llm_hedges_total")
@@ -2,58 +2,185 @@
 import os
 import ast
 import re
-from tqdm import tqdm
-from app.utils import get_embedding
-from binaryornot.check import is_binary
+from app.utils import get_embeddings
+from app.metrics import span
+from app.scheduler import priority
+from app.outline import record_outline
+from app.repo_files import get_snapshot, file_cache
 
-def add_file_name(content: str, full_path: str, repo_path: str) -> str:
+# Bump whenever the chunking below changes, so prebuilt indexes can be told apart
+# (4: files come from the repo snapshot, which skips .git and .gitignored files)
+CHUNKER_VERSION = 4
+
+# Number of chunks sent to the embedding backend per call
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "128"))
+
+def get_relative_path(full_path: str, repo_path: str) -> str:
     full_path = full_path.replace("\\",r"/")
     repo_path = repo_path.replace("\\",r"/")
-    file_name = full_path.replace(repo_path + "/", "")
+    return full_path.replace(repo_path + "/", "")
+
+def add_file_name(content: str, full_path: str, repo_path: str) -> str:
+    file_name = get_relative_path(full_path, repo_path)
     return f"In file {file_name}, the content is {content}"
 
-# Parse all .py files and extract class/function chunks
-def get_chunks_for_repo(repo_path: str):
-    chunks = []
-    for dirpath, _, filenames in os.walk(repo_path):
-        for file in tqdm(filenames, desc="Processing files"):
-            full_path = os.path.join(dirpath, file)
-            if is_binary(full_path):
+# Names that are defined in more chunks than this are too ambiguous to link (e.g. __init__, run)
+MAX_DEFINITIONS_PER_NAME = 8
+
+def get_node_name(node):
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    return None
+
+# Names a code node refers to, as [name, kind] pairs with kind one of "import", "inherit", "call"
+def get_references(node) -> list:
+    refs = []
+    for child in ast.walk(node):
+        if isinstance(child, (ast.Import, ast.ImportFrom)):
+            refs.extend([alias.name.split(".")[-1], "import"] for alias in child.names)
+        elif isinstance(child, ast.ClassDef):
+            refs.extend([get_node_name(base), "inherit"] for base in child.bases)
+        elif isinstance(child, ast.Call):
+            refs.append([get_node_name(child.func), "call"])
+
+    own_name = getattr(node, "name", None)
+    unique_refs = []
+    for ref in refs:
+        if ref[0] and ref[0] != own_name and ref not in unique_refs:
+            unique_refs.append(ref)
+    return unique_refs
+
+# Chunks record their file and 1-based inclusive line span, used to de-duplicate overlapping snippets,
+# and for code the name they define and the names they reference, used to build the cross-reference graph
+def make_chunk(snippet: str, full_path: str, repo_path: str, start_line: int, end_line: int, node=None) -> dict:
+    chunk = {
+        "content": add_file_name(snippet, full_path, repo_path),
+        "file": get_relative_path(full_path, repo_path),
+        "start_line": start_line,
+        "end_line": end_line,
+    }
+    if node is not None:
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            chunk["name"] = node.name
+        chunk["refs"] = get_references(node)
+    return chunk
+
+def build_xref_graph(chunks: list) -> dict:
+    """
+    Link each chunk to the chunks defining the names it imports, calls or inherits from.
+    The graph is stored as adjacency arrays keyed by chunk id: the neighbours of chunk i are
+    targets[offsets[i]:offsets[i + 1]], with the edge kinds at the same positions in kinds.
+    """
+    definitions = {}
+    for chunk_id, chunk in enumerate(chunks):
+        if "name" in chunk:
+            definitions.setdefault(chunk["name"], []).append(chunk_id)
+
+    kind_order = {"inherit": 0, "import": 1, "call": 2}
+    offsets, targets, kinds = [0], [], []
+    for chunk_id, chunk in enumerate(chunks):
+        edges = {}
+        for name, kind in sorted(chunk.get("refs", []), key=lambda ref: kind_order[ref[1]]):
+            defined_in = definitions.get(name, [])
+            if len(defined_in) > MAX_DEFINITIONS_PER_NAME:
                 continue
+            for target in defined_in:
+                if target != chunk_id:
+                    edges.setdefault(target, kind)
+        targets.extend(edges.keys())
+        kinds.extend(edges.values())
+        offsets.append(len(targets))
+    return {"offsets": offsets, "targets": targets, "kinds": kinds}
+
+# Files of the repo from its shared snapshot, the same list the file tools see
+def iter_repo_files(repo_path: str):
+    for rel_path in get_snapshot(repo_path).list():
+        yield os.path.join(repo_path, rel_path)
+
+def read_source(full_path: str):
+    """Text of a file through the shared file cache, or None for a binary file."""
+    from binaryornot.helpers import is_binary_string
+    data = file_cache.read_bytes(full_path)
+    if is_binary_string(data[:1024]):
+        return None
+    # Universal newlines, as a file opened in text mode
+    return data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+# Parse a .py file into class/function chunks, or make a single chunk of any other text file
+def extract_chunks(full_path: str, repo_path: str, source: str = None) -> list:
+    chunks = []
+    if source is None:
+        source = read_source(full_path) or ""
+
+    if full_path.endswith(".py"):
+        lines = source.splitlines()
+        tree = ast.parse(source)
+        # Reused by the outline tool, so it does not parse indexed files again
+        record_outline(full_path, tree)
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+                start_line = node.lineno - 1
+                end_line = getattr(node, "end_lineno", None) or start_line + 1
+                snippet = "\n".join(lines[start_line:end_line])
+                chunks.append(make_chunk(snippet, full_path, repo_path, start_line + 1, end_line, node))
+
+            elif isinstance(node, ast.Module):
+                for element in node.body:
+                    start_line = element.lineno - 1
+                    end_line = getattr(element, "end_lineno", None) or start_line + 1
+                    snippet = "\n".join(lines[start_line:end_line])
+                    chunks.append(make_chunk(snippet, full_path, repo_path, start_line + 1, end_line, element))
+                    # ast.Expr, ast.Import, ast.ImportFrom, ast.Constant, ast.alias, ast.arguments, ast.With, ast.Call
+    else:
+        chunks.append(make_chunk(source, full_path, repo_path, 1, max(len(source.splitlines()), 1)))
+    return chunks
+
+# Embed chunks in batches. If a batch fails (e.g. one text is over the model's input limit),
+# its chunks are retried one by one and the ones that still fail are dropped.
+def embed_chunks(chunks: list, batch_size: int = EMBEDDING_BATCH_SIZE) -> list:
+    from tqdm import tqdm
+    embedded = []
+    for i in tqdm(range(0, len(chunks), batch_size), desc="Embedding chunks"):
+        batch = chunks[i:i + batch_size]
+        # Indexing is bulk traffic: queued OpenAI calls of interactive questions go first
+        with priority("background"):
             try:
-                if file.endswith(".py"):
-                    with open(full_path, "r", encoding="utf-8") as f:
-                        source = f.read()
-                        tree = ast.parse(source)
-                        for node in tqdm(ast.walk(tree), desc="Processing nodes"):
-                            if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
-                                start_line = node.lineno - 1
-                                end_line = getattr(node, "end_lineno", None) or start_line + 1
-                                snippet = "\n".join(source.splitlines()[start_line:end_line])
-                                snippet = add_file_name(snippet, full_path, repo_path)
-                                embedding = get_embedding(snippet)
-                                chunks.append({"content": snippet, "embedding": embedding})
-
-                            elif isinstance(node, ast.Module):
-                                for element in node.body:
-                                    start_line = element.lineno - 1
-                                    end_line = getattr(element, "end_lineno", None) or start_line + 1
-                                    snippet = "\n".join(source.splitlines()[start_line:end_line])
-                                    snippet = add_file_name(snippet, full_path, repo_path)
-                                    embedding = get_embedding(snippet)
-                                    chunks.append({"content": snippet, "embedding": embedding})
-                                    # ast.Expr, ast.Import, ast.ImportFrom, ast.Constant, ast.alias, ast.arguments, ast.With, ast.Call
-
-                else:
-                    with open(full_path, "r", encoding="utf-8") as f:
-                        source = f.read()
-                        source = add_file_name(source, full_path, repo_path)
-                        embedding = get_embedding(source)
-                        chunks.append({"content": source, "embedding": embedding})
+                embeddings = get_embeddings([chunk["content"] for chunk in batch])
+            except Exception as e:
+                print(f"Error embedding batch, retrying one by one: {e}")
+                embeddings = []
+                for chunk in batch:
+                    try:
+                        embeddings.append(get_embeddings([chunk["content"]])[0])
+                    except Exception as e:
+                        print(f"Error embedding chunk from {chunk['file']}: {e}")
+                        embeddings.append(None)
+
+        for chunk, embedding in zip(batch, embeddings):
+            if embedding is not None:
+                chunk["embedding"] = embedding
+                embedded.append(chunk)
+    return embedded
 
+def get_chunks_for_repo(repo_path: str):
+    from tqdm import tqdm
+
+    with span("walk"):
+        files = list(iter_repo_files(repo_path))
+
+    chunks = []
+    with span("parse"):
+        for full_path in tqdm(files, desc="Processing files"):
+            try:
+                source = read_source(full_path)
+                if source is None:
+                    continue
+                chunks.extend(extract_chunks(full_path, repo_path, source))
             except Exception as e:
                 print(f"Error processing {full_path}: {e}")
                 continue
 
-    return chunks
-
+    with span("embed"):
+        return embed_chunks(chunks)
@@ -0,0 +1,92 @@
+# --- app/index_store.py ---
+import gzip
+import hashlib
+import json
+import subprocess
+from datetime import datetime, timezone
+from app.index_builder import CHUNKER_VERSION
+from app.utils import get_embedding_backend
+
+# Prebuilt index file layout (gzip compressed):
+#   line 1: JSON header describing the index, including the sha256 of the payload
+#   line 2: JSON payload with the chunks
+INDEX_MAGIC = "mcp-repo-index"
+INDEX_FORMAT_VERSION = 1
+
+
+class IndexFileError(ValueError):
+    """Raised when a prebuilt index file is corrupt or incompatible"""
+
+
+def get_source_commit(repo_path: str):
+    try:
+        result = subprocess.run(
+            ["git", "-C", repo_path, "rev-parse", "HEAD"],
+            capture_output=True, text=True, check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def save_index(chunks: list, output_path: str, repo_path: str) -> dict:
+    payload = json.dumps({"chunks": chunks}, separators=(",", ":")).encode("utf-8")
+    header = {
+        "magic": INDEX_MAGIC,
+        "format_version": INDEX_FORMAT_VERSION,
+        "embedding_model": get_embedding_backend().name,
+        "chunker_version": CHUNKER_VERSION,
+        "source_commit": get_source_commit(repo_path),
+        "repo_path": repo_path,
+        "num_chunks": len(chunks),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "sha256": hashlib.sha256(payload).hexdigest(),
+    }
+    with gzip.open(output_path, "wb") as f:
+        f.write(json.dumps(header).encode("utf-8") + b"\n")
+        f.write(payload)
+    return header
+
+
+def read_index_header(index_path: str) -> dict:
+    with gzip.open(index_path, "rb") as f:
+        return _parse_header(f.readline(), index_path)
+
+
+def load_index(index_path: str):
+    """
+    Load a prebuilt index, returning (header, chunks).
+    Raises IndexFileError if the file is corrupt or was built with a different embedding model.
+    """
+    with gzip.open(index_path, "rb") as f:
+        header = _parse_header(f.readline(), index_path)
+        payload = f.read()
+
+    if hashlib.sha256(payload).hexdigest() != header.get("sha256"):
+        raise IndexFileError(f"Checksum mismatch in index file: {index_path}")
+    embedding_model = get_embedding_backend().name
+    if header.get("embedding_model") != embedding_model:
+        raise IndexFileError(
+            f"Index {index_path} was embedded with {header.get('embedding_model')}, "
+            f"but the server uses {embedding_model}"
+        )
+    if header.get("chunker_version") != CHUNKER_VERSION:
+        print(f"Warning: index {index_path} was built with chunker version "
+              f"{header.get('chunker_version')}, current version is {CHUNKER_VERSION}")
+
+    chunks = json.loads(payload.decode("utf-8"))["chunks"]
+    return header, chunks
+
+
+def _parse_header(line: bytes, index_path: str) -> dict:
+    try:
+        header = json.loads(line.decode("utf-8"))
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        raise IndexFileError(f"Not a prebuilt index file: {index_path}")
+    if not isinstance(header, dict) or header.get("magic") != INDEX_MAGIC:
+        raise IndexFileError(f"Not a prebuilt index file: {index_path}")
+    if header.get("format_version") != INDEX_FORMAT_VERSION:
+        raise IndexFileError(
+            f"Unsupported index format version {header.get('format_version')} in {index_path}"
+        )
+    return header
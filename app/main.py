@@ -1,8 +1,24 @@
 # --- app/main.py ---
+import asyncio
+import json
 import os
+import re
+from typing import List, Optional
 from pydantic import BaseModel, Field
-from app.rag_pipeline import answer_question
-from fastmcp import FastMCP
+from app.rag_pipeline import answer_question, retrieve_for_questions, generate_answer, retrieve_chunks as retrieve_ranked_chunks
+from app.coalescing import coalesce, coalesce_key
+from app.metrics import get_stats, render_prometheus
+from app.usage import attribute, get_usage
+from app.profiling import maybe_profile, configure_profiling
+from app.scheduler import scheduler
+from app.repo_files import file_cache, list_repo_files, encode_cursor as encode_path_cursor
+from app.search import search_repo, encode_cursor as encode_match_cursor
+from app.file_reader import read_file_range
+from app.outline import repo_outline
+from app.token_budget import fit_answer, fit_file, fit_list, resolve_budget
+from fastmcp import FastMCP, Context
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
 
 mcp = FastMCP(name="DynamicRepoMCP")
 
@@ -11,64 +27,202 @@ mcp = FastMCP(name="DynamicRepoMCP")
 class QARequest(BaseModel):
     repo_path: str = Field(description="The path to the repository that contains the files to answer the question")
     question: str = Field(description="The question to answer")
+    caller: Optional[str] = Field(default=None, description="Identifier of the calling client, used for usage accounting")
+    profile: bool = Field(default=False, description="Capture a CPU profile of this request")
+    deadline_seconds: Optional[float] = Field(default=None, description="Seconds to wait for the answer before returning the retrieved code instead (0 for no deadline). Defaults to LLM_DEADLINE_SECONDS")
+    hedge: Optional[bool] = Field(default=None, description="Fire a duplicate completion when the first is slower than usual. Defaults to LLM_HEDGE")
+    max_tokens: Optional[int] = Field(default=None, description="Token budget of the response (0 for no limit). Defaults to MCP_TOOL_MAX_TOKENS")
+
+def answer_with_accounting(request: QARequest, caller: str) -> dict:
+    # Runs in a worker thread, so the profiler sees the whole request
+    with attribute(request.repo_path, caller), \
+            maybe_profile("ask_question", force=request.profile) as profile_path:
+        result = answer_question(request.repo_path, request.question,
+                                 deadline=request.deadline_seconds, hedge=request.hedge)
+    if profile_path:
+        result["profile"] = profile_path
+    return result
+
 
 # Define a tool for the MCP server
 @mcp.tool()
-async def ask_question(request: QARequest):
+async def ask_question(request: QARequest, ctx: Context):
     """
     Ask a question about the repository
     """
-    answer = answer_question(request.repo_path, request.question)
-    return {"question": request.question, "answer": answer}
+    # Identical concurrent questions share one retrieval and completion, billed to the first caller
+    key = coalesce_key(request.repo_path, request.question, profile=request.profile,
+                       deadline_seconds=request.deadline_seconds, hedge=request.hedge)
+    caller = request.caller or ctx.client_id
+    result = await coalesce(key, lambda: asyncio.to_thread(answer_with_accounting, request, caller))
+    return {"question": request.question, **fit_answer(result, request.max_tokens)}
+
+
+# Completions run concurrently by one ask_questions call, unless the request sets its own limit
+ASK_QUESTIONS_CONCURRENCY = int(os.getenv("MCP_ASK_QUESTIONS_CONCURRENCY", "4"))
+
+class BatchQARequest(BaseModel):
+    repo_path: str = Field(description="The path to the repository that contains the files to answer the questions")
+    questions: List[str] = Field(description="The questions to answer")
+    caller: Optional[str] = Field(default=None, description="Identifier of the calling client, used for usage accounting")
+    max_concurrency: Optional[int] = Field(default=None, description="Maximum completions running at once. Defaults to MCP_ASK_QUESTIONS_CONCURRENCY")
+    deadline_seconds: Optional[float] = Field(default=None, description="Seconds to wait for each answer before returning the retrieved code instead (0 for no deadline). Defaults to LLM_DEADLINE_SECONDS")
+    hedge: Optional[bool] = Field(default=None, description="Fire a duplicate completion when one is slower than usual. Defaults to LLM_HEDGE")
+    max_tokens: Optional[int] = Field(default=None, description="Token budget of the response, shared equally by the questions (0 for no limit). Defaults to MCP_TOOL_MAX_TOKENS")
+
+@mcp.tool()
+async def ask_questions(request: BatchQARequest, ctx: Context):
+    """
+    Ask many questions about the same repository at once. Questions are retrieved for together and answered
+    concurrently; each result is sent as a progress notification as soon as it is ready.
+    Results are returned in the order of the questions.
+    """
+    if not request.questions:
+        return {"results": []}
+    budget = resolve_budget(request.max_tokens)
+    budget_per_question = max(1, budget // max(1, len(request.questions))) if budget else 0
+    with attribute(request.repo_path, request.caller or ctx.client_id):
+        retrieved = await asyncio.to_thread(retrieve_for_questions, request.repo_path, request.questions)
+        semaphore = asyncio.Semaphore(max(1, request.max_concurrency or ASK_QUESTIONS_CONCURRENCY))
+
+        async def answer(index: int):
+            async with semaphore:
+                result = await asyncio.to_thread(generate_answer, request.questions[index], retrieved[index],
+                                                 request.deadline_seconds, request.hedge)
+            return {"index": index, "question": request.questions[index], **fit_answer(result, budget_per_question)}
+
+        results = [None] * len(request.questions)
+        for finished, task in enumerate(asyncio.as_completed([answer(i) for i in range(len(request.questions))]), 1):
+            result = await task
+            results[result["index"]] = result
+            await ctx.report_progress(finished, len(results), message=json.dumps(result))
+    return {"results": results}
+
+
+@mcp.tool()
+async def retrieve_chunks(repo_path: str, query: str, max_tokens: int = 4000, k: int = 20,
+                          paths: Optional[List[str]] = None, expand_references: bool = True, caller: Optional[str] = None,
+                          ctx: Context = None):
+    """
+    Retrieve the code chunks most relevant to the query, without generating an answer.
+    Returns up to k chunks best first, plus the definitions they reference, with file, line span, score and
+    token count, within max_tokens. paths limits the search to files matching these globs or directories.
+    """
+    with attribute(repo_path, caller or (ctx.client_id if ctx else None)):
+        return await asyncio.to_thread(retrieve_ranked_chunks, repo_path, query, max_tokens, k, paths, expand_references)
+
+
+@mcp.tool()
+def profiling(sample_rate: Optional[float] = None, memory: Optional[bool] = None):
+    """
+    Change, without restarting, the fraction of ask_question requests that are CPU profiled (0 to 1),
+    and whether a tracemalloc snapshot is captured with each profile. Returns the current settings.
+    """
+    return configure_profiling(sample_rate, memory)
+
+
+@mcp.tool()
+def usage_stats(repo_path: Optional[str] = None, caller: Optional[str] = None):
+    """
+    Prompt, completion and embedding tokens used and their estimated cost in USD,
+    for one repo or one caller, or in total and broken down per repo and per caller
+    """
+    return get_usage(repo_path, caller)
 
 
 @mcp.tool()
-def list_files(repo_path: str):
+def server_stats():
     """
-    List all files in the repository
+    Per-stage timings of the server (walk, parse, embed, embed_query, retrieve, expand, pack, llm):
+    number of calls, errors, total and mean seconds, and requests in flight,
+    and the state of the OpenAI rate budgets: available requests and tokens, and queued calls,
+    and of the shared file cache: stat calls and file reads made, and those served from the cache
+    """
+    return dict(get_stats(), openai_scheduler=scheduler.get_stats(), file_cache=file_cache.get_stats())
+
+
+# Prometheus scrape endpoint, served next to /mcp when running over HTTP
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics(request: Request):
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@mcp.tool()
+def list_files(repo_path: str, cursor: Optional[str] = None, limit: int = 1000, glob: Optional[str] = None,
+               max_depth: Optional[int] = None, respect_ignore: bool = True, max_tokens: Optional[int] = None):
+    """
+    List the files in the repository, one page at a time, in path order.
+    Pass the returned next_cursor to get the next page; it is null on the last page.
+    glob filters the relative paths (e.g. "*.py", "docs/*"), max_depth limits how deep to list (0 = top level only),
+    and respect_ignore skips the files excluded by .gitignore. The .git directory is never listed.
+    A page over max_tokens (default MCP_TOOL_MAX_TOKENS) is cut short, with next_cursor continuing after it.
     """
     if not os.path.exists(repo_path):
         return {"error": f"Repo path does not exist: {repo_path}"}
-    files = []
-    for root, _, filenames in os.walk(repo_path):
-        for f in filenames:
-            files.append(os.path.relpath(os.path.join(root, f), repo_path))
-    return {"files": files}
+    try:
+        return fit_list(list_repo_files(repo_path, cursor, limit, glob, max_depth, respect_ignore), "files",
+                        max_tokens, cursor_of=encode_path_cursor)
+    except ValueError as e:
+        return {"error": str(e)}
 
 
 @mcp.tool()
-def read_file(repo_path: str, file_path: str):
+def outline(repo_path: str, paths: Optional[List[str]] = None, max_depth: Optional[int] = None,
+            cursor: Optional[str] = None, max_tokens: Optional[int] = None):
     """
-    Read a specific file from the repo
+    Outline of the repo's Python code in one call: for each module, its docstring and the tree of classes and
+    functions with their signatures, first docstring line and line span. paths limits it to these files,
+    directories or globs; max_depth 0 lists modules only, 1 adds top-level classes and functions, 2 methods.
+    Modules over max_tokens (default MCP_TOOL_MAX_TOKENS) are left out; pass next_cursor to get them.
+    """
+    if not os.path.exists(repo_path):
+        return {"error": f"Repo path does not exist: {repo_path}"}
+    try:
+        return fit_list(repo_outline(repo_path, paths, max_depth, cursor), "modules", max_tokens,
+                        cursor_of=lambda module: encode_path_cursor(module["file"]))
+    except ValueError as e:
+        return {"error": str(e)}
+
+
+@mcp.tool()
+def read_file(repo_path: str, file_path: str, start_line: Optional[int] = None, end_line: Optional[int] = None,
+              byte_offset: Optional[int] = None, byte_length: Optional[int] = None, max_bytes: Optional[int] = None,
+              max_tokens: Optional[int] = None):
+    """
+    Read a specific file from the repo, or only lines start_line to end_line (1-based, inclusive),
+    or byte_length bytes from byte_offset. At most max_bytes of content are returned (default MCP_READ_FILE_MAX_BYTES);
+    a larger file read whole returns its size and its first lines, flagged truncated.
+    Content over max_tokens (default MCP_TOOL_MAX_TOKENS) keeps its first and last lines; the omitted lines are
+    reported, and next_start_line (or next_byte_offset, for a byte range or a single line too long) continues from them.
     """
     full_path = os.path.join(repo_path, file_path)
-    if not os.path.exists(full_path):
+    try:
+        file_cache.stat(full_path)
+    except OSError:
         return {"error": f"File not found: {full_path}"}
     try:
-        with open(full_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        return {"content": content}
+        return fit_file(read_file_range(full_path, start_line, end_line, byte_offset, byte_length, max_bytes), max_tokens)
     except Exception as e:
         return {"error": str(e)}
 
 @mcp.tool()
-def search_in_repo(repo_path: str, query: str):
-    """
-    Search for a keyword in all files of the repo
-    """
-    matches = []
-    for root, _, filenames in os.walk(repo_path):
-        for f in filenames:
-            file_path = os.path.join(root, f)
-            try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as fp:
-                    for i, line in enumerate(fp.readlines()):
-                        if query in line:
-                            matches.append({
-                                "file": os.path.relpath(file_path, repo_path),
-                                "line": i + 1,
-                                "content": line.strip()
-                            })
-            except Exception:
-                continue
-    return {"matches": matches}
\ No newline at end of file
+def search_in_repo(repo_path: str, query: str, regex: bool = False, case_sensitive: bool = True, limit: int = 200,
+                   context_lines: int = 0, glob: Optional[str] = None, cursor: Optional[str] = None,
+                   max_tokens: Optional[int] = None):
+    """
+    Search the files of the repo for a keyword, or a regular expression with regex=true.
+    Returns at most limit matching lines (file, line number, content), with context_lines lines before and after
+    each match. glob restricts the files searched (e.g. "*.py"). Binary files, .git and .gitignored files are skipped.
+    If truncated, pass next_cursor to get the following matches. Matches over max_tokens (default MCP_TOOL_MAX_TOKENS)
+    are left out and counted per file in omitted_per_file.
+    Results can be stale: new, removed and renamed files are seen within MCP_SNAPSHOT_TTL seconds, and with
+    MCP_TRIGRAM_INDEX=1 new content of a file edited in place within about MCP_TRIGRAM_REFRESH_SECONDS.
+    """
+    if not os.path.exists(repo_path):
+        return {"error": f"Repo path does not exist: {repo_path}"}
+    try:
+        return fit_list(search_repo(repo_path, query, regex, case_sensitive, limit, context_lines, glob, cursor),
+                        "matches", max_tokens, cursor_of=lambda match: encode_match_cursor(match["file"], match["line"]),
+                        count_by="file", clip_key="content")
+    except (re.error, ValueError) as e:
+        return {"error": str(e)}
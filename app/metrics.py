@@ -0,0 +1,147 @@
+# --- app/metrics.py ---
+import os
+import threading
+import time
+
+# Set MCP_METRICS=0 to disable. Spans then return a shared no-op object, so instrumentation costs one call.
+METRICS_ENABLED = os.getenv("MCP_METRICS", "1") != "0"
+
+# Histogram bucket upper bounds, in seconds
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_lock = threading.Lock()
+# Keyed by (metric name, sorted label items)
+_counters = {}
+_gauges = {}
+_histograms = {}
+
+
+def _key(name: str, labels: dict):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc_counter(name: str, value: float = 1, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def add_gauge(name: str, delta: float, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = _gauges.get(key, 0) + delta
+
+
+def observe(name: str, value: float, buckets=DURATION_BUCKETS, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                histogram["counts"][i] += 1
+                break
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+class _Span:
+    """Times a stage: in-flight gauge while running, then a duration histogram and an ok/error counter."""
+    __slots__ = ("stage", "start_time")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        add_gauge("mcp_stage_in_flight", 1, stage=self.stage)
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        observe("mcp_stage_duration_seconds", time.perf_counter() - self.start_time, stage=self.stage)
+        add_gauge("mcp_stage_in_flight", -1, stage=self.stage)
+        inc_counter("mcp_stage_total", stage=self.stage, status="error" if exc_type else "ok")
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(stage: str):
+    return _Span(stage) if METRICS_ENABLED else _NOOP_SPAN
+
+
+def _format_labels(labels, extra=()) -> str:
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in items) + "}"
+
+
+def render_prometheus() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {key: dict(value, counts=list(value["counts"])) for key, value in _histograms.items()}
+
+    lines = []
+    typed = set()
+    for metrics, metric_type in ((counters, "counter"), (gauges, "gauge")):
+        for (name, labels), value in sorted(metrics.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} {metric_type}")
+                typed.add(name)
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for (name, labels), histogram in sorted(histograms.items()):
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        cumulative = 0
+        for bound, count in zip(histogram["buckets"], histogram["counts"]):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def get_stats() -> dict:
+    """Per-stage summary: count, errors, total and mean seconds, and in-flight requests."""
+    with _lock:
+        stages = {}
+        for (name, labels), histogram in _histograms.items():
+            if name == "mcp_stage_duration_seconds":
+                stage = dict(labels)["stage"]
+                stages[stage] = {
+                    "count": histogram["count"],
+                    "total_seconds": histogram["sum"],
+                    "mean_seconds": histogram["sum"] / histogram["count"] if histogram["count"] else 0,
+                }
+        for (name, labels), value in _counters.items():
+            label_dict = dict(labels)
+            if name == "mcp_stage_total" and label_dict.get("status") == "error":
+                stages.setdefault(label_dict["stage"], {})["errors"] = value
+        for (name, labels), value in _gauges.items():
+            if name == "mcp_stage_in_flight":
+                stages.setdefault(dict(labels)["stage"], {})["in_flight"] = value
+    return {"enabled": METRICS_ENABLED, "stages": stages}
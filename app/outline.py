@@ -0,0 +1,104 @@
+# --- app/outline.py ---
+import ast
+import os
+import threading
+from app.metrics import span
+from app.repo_files import decode_cursor, file_cache, get_snapshot, matches_paths
+
+# Realpath of a .py file -> (mtime_ns, size, outline). Filled while indexing, from the AST the chunker parsed,
+# and on demand for files of repos that were not indexed (or changed since), parsed without embedding
+_outlines = {}
+_outlines_lock = threading.Lock()
+
+
+def _signature(node) -> str:
+    if isinstance(node, ast.ClassDef):
+        bases = [ast.unparse(base) for base in node.bases] + [ast.unparse(keyword) for keyword in node.keywords]
+        return f"class {node.name}({', '.join(bases)})" if bases else f"class {node.name}"
+    prefix = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+    returns = f" -> {ast.unparse(node.returns)}" if node.returns else ""
+    return f"{prefix} {node.name}({ast.unparse(node.args)}){returns}"
+
+
+def _doc(node):
+    docstring = ast.get_docstring(node)
+    return docstring.strip().splitlines()[0] if docstring and docstring.strip() else None
+
+
+def _outline_body(body: list) -> list:
+    entries = []
+    for node in body:
+        if isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+            entries.append({
+                "name": node.name,
+                "kind": "class" if isinstance(node, ast.ClassDef) else "function",
+                "signature": _signature(node),
+                "doc": _doc(node),
+                "start_line": node.lineno,
+                "end_line": getattr(node, "end_lineno", None) or node.lineno,
+                "children": _outline_body(node.body),
+            })
+    return entries
+
+
+def outline_tree(tree: ast.Module) -> dict:
+    """Module docstring and the nested classes and functions of a parsed module."""
+    return {"doc": _doc(tree), "children": _outline_body(tree.body)}
+
+
+def record_outline(full_path: str, tree: ast.Module):
+    """Keep the outline of a file parsed elsewhere (by the chunker), so outline requests do not parse it again."""
+    key = os.path.realpath(full_path)
+    try:
+        stats = file_cache.stat(key)
+    except OSError:
+        return
+    outline = outline_tree(tree)
+    with _outlines_lock:
+        _outlines[key] = stats + (outline,)
+
+
+def get_file_outline(full_path: str) -> dict:
+    """Outline of a file, given by its real path."""
+    stats = file_cache.stat(full_path)
+    with _outlines_lock:
+        cached = _outlines.get(full_path)
+    if cached is not None and cached[:2] == stats:
+        return cached[2]
+    outline = outline_tree(ast.parse(file_cache.read_bytes(full_path).decode("utf-8")))
+    with _outlines_lock:
+        _outlines[full_path] = stats + (outline,)
+    return outline
+
+
+def _limit_depth(entries: list, depth: int) -> list:
+    if depth <= 0:
+        return []
+    return [dict(entry, children=_limit_depth(entry["children"], depth - 1)) for entry in entries]
+
+
+def repo_outline(repo_path: str, paths: list = None, max_depth: int = None, cursor: str = None) -> dict:
+    """
+    Outline of the repo's Python modules: module -> class -> function tree with signatures, first docstring lines
+    and line spans. paths limits it to matching files or directories; max_depth 0 lists modules only,
+    1 adds their top-level classes and functions, 2 methods, and so on (no limit by default).
+    cursor (a list_files cursor) starts after that module.
+    """
+    with span("outline"):
+        root = os.path.realpath(repo_path)
+        after = decode_cursor(cursor) if cursor else None
+        modules = []
+        for rel_path in get_snapshot(repo_path).list("*.py"):
+            if (after is not None and rel_path <= after) or (paths and not matches_paths(rel_path, paths)):
+                continue
+            module = {"file": rel_path}
+            try:
+                outline = get_file_outline(os.path.join(root, rel_path))
+            except (OSError, SyntaxError, ValueError, UnicodeDecodeError) as e:
+                module["error"] = str(e)
+                modules.append(module)
+                continue
+            module["doc"] = outline["doc"]
+            module["children"] = outline["children"] if max_depth is None else _limit_depth(outline["children"], max_depth)
+            modules.append(module)
+        return {"modules": modules}
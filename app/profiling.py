@@ -0,0 +1,62 @@
+# --- app/profiling.py ---
+import cProfile
+import os
+import random
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+
+# Profiles are written to MCP_PROFILE_DIR as <timestamp>-<name>-<id>.prof (cProfile/pstats format,
+# open with snakeviz or `python -m pstats`) and, with memory profiling on, <...>.tracemalloc snapshots
+# (load with tracemalloc.Snapshot.load). MCP_PROFILE_SAMPLE_RATE is the fraction of requests profiled
+# (MCP_PROFILE=1 profiles every request); both can be changed at runtime with configure_profiling.
+PROFILE_DIR = os.getenv("MCP_PROFILE_DIR", "profiles")
+_settings = {
+    "sample_rate": 1.0 if os.getenv("MCP_PROFILE") == "1" else float(os.getenv("MCP_PROFILE_SAMPLE_RATE", "0")),
+    "memory": os.getenv("MCP_PROFILE_MEMORY") == "1",
+}
+# Only one cProfile profiler can be active at a time, so concurrent requests are not profiled
+_profiler_lock = threading.Lock()
+
+
+def configure_profiling(sample_rate: float = None, memory: bool = None) -> dict:
+    if sample_rate is not None:
+        _settings["sample_rate"] = min(max(sample_rate, 0.0), 1.0)
+    if memory is not None:
+        _settings["memory"] = memory
+    return dict(_settings, profile_dir=PROFILE_DIR)
+
+
+@contextmanager
+def maybe_profile(name: str, force: bool = False, memory: bool = None):
+    """
+    Profile the block if forced or sampled, yielding the path of the .prof file it is written to
+    (the tracemalloc snapshot, if any, is next to it with a .tracemalloc extension), or None if the block is not profiled.
+    """
+    sampled = force or random.random() < _settings["sample_rate"]
+    if not sampled or not _profiler_lock.acquire(blocking=False):
+        yield None
+        return
+
+    memory = _settings["memory"] if memory is None else memory
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    prefix = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{uuid.uuid4().hex[:8]}")
+    started_tracemalloc = memory and not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start()
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        try:
+            yield prefix + ".prof"
+        finally:
+            profiler.disable()
+            profiler.dump_stats(prefix + ".prof")
+            if memory:
+                tracemalloc.take_snapshot().dump(prefix + ".tracemalloc")
+    finally:
+        if started_tracemalloc:
+            tracemalloc.stop()
+        _profiler_lock.release()
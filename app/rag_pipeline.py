@@ -1,18 +1,118 @@
 # --- app/rag_pipeline.py ---
 import os
-from app.index_builder import get_chunks_for_repo
-from app.utils import get_top_k_chunks, call_openai_with_context
+import threading
+from app.index_builder import get_chunks_for_repo, build_xref_graph
+from app.index_store import load_index
+from app.metrics import span
+from app.repo_files import matches_paths
+from app.trigram_index import TRIGRAM_INDEX_ENABLED, get_trigram_index
+from app.utils import get_top_k_chunks, get_top_k_chunks_batch, get_embedding_matrix, expand_with_references, \
+    call_openai_with_context, get_embedding, rank_chunks, chunk_tokens
 
 # In-memory index (could use Chroma or FAISS for persistent index)
 repo_index_cache = {}
+# Normalized embedding matrix per repo, built once from the cached chunks
+repo_matrix_cache = {}
+# Cross-reference graph per repo, linking chunks to the definitions they refer to
+repo_graph_cache = {}
+# Requests run in worker threads; one lock per repo so concurrent first questions build its index once
+repo_locks = {}
+repo_locks_guard = threading.Lock()
 
-# Main entrypoint for question-answering
-def answer_question(repo_path: str, question: str) -> str:
-    if repo_path not in repo_index_cache:
-        repo_index_cache[repo_path] = get_chunks_for_repo(repo_path)
+# Load a prebuilt index file into the cache, keyed by repo_path (defaults to the path it was built from)
+def load_prebuilt_index(index_path: str, repo_path: str = None) -> str:
+    header, chunks = load_index(index_path)
+    repo_path = repo_path or header["repo_path"]
+    repo_index_cache[repo_path] = chunks
+    repo_matrix_cache.pop(repo_path, None)
+    repo_graph_cache.pop(repo_path, None)
+    print(f"Loaded prebuilt index for {repo_path} ({len(chunks)} chunks, commit {header['source_commit']})")
+    return repo_path
+
+def get_repo_lock(repo_path: str) -> threading.RLock:
+    with repo_locks_guard:
+        return repo_locks.setdefault(repo_path, threading.RLock())
+
+def get_repo_index(repo_path: str):
+    if repo_path not in repo_matrix_cache:
+        with get_repo_lock(repo_path):
+            if repo_path not in repo_index_cache:
+                repo_index_cache[repo_path] = get_chunks_for_repo(repo_path)
+                if TRIGRAM_INDEX_ENABLED:
+                    # Keep the search index in step with the RAG index
+                    get_trigram_index(repo_path, force_refresh=True)
+            if repo_path not in repo_matrix_cache:
+                repo_matrix_cache[repo_path] = get_embedding_matrix(repo_index_cache[repo_path])
+    return repo_index_cache[repo_path], repo_matrix_cache[repo_path]
+
+def get_repo_graph(repo_path: str) -> dict:
+    if repo_path not in repo_graph_cache:
+        with get_repo_lock(repo_path):
+            if repo_path not in repo_graph_cache:
+                chunks, _ = get_repo_index(repo_path)
+                repo_graph_cache[repo_path] = build_xref_graph(chunks)
+    return repo_graph_cache[repo_path]
 
-    chunks = repo_index_cache[repo_path]
-    top_chunks = get_top_k_chunks(question, chunks, k=5)
+def generate_answer(question: str, top_chunks: list, deadline: float = None, hedge: bool = None) -> dict:
+    """
+    Returns {"answer": ...}. If the completion misses its deadline, returns the retrieved chunks instead,
+    flagged with "generation_timed_out", so the caller still gets the relevant code.
+    """
     context_list = [chunk["content"] for chunk in top_chunks]
-    return call_openai_with_context(question, context_list)
+    try:
+        return {"answer": call_openai_with_context(question, context_list, deadline=deadline, hedge=hedge)}
+    except TimeoutError:
+        return {"answer": None, "generation_timed_out": True, "chunks": top_chunks}
+
+# Main entrypoint for question-answering
+def answer_question(repo_path: str, question: str, deadline: float = None, hedge: bool = None) -> dict:
+    with span("answer_question"):
+        chunks, embedding_matrix = get_repo_index(repo_path)
+        top_chunks = get_top_k_chunks(question, chunks, k=5, embedding_matrix=embedding_matrix)
+        with span("expand"):
+            top_chunks = expand_with_references(top_chunks, chunks, get_repo_graph(repo_path))
+        return generate_answer(question, top_chunks, deadline, hedge)
+
+# Retrieval for a batch of questions: one embedding call and one similarity matrix product for all of them
+def retrieve_for_questions(repo_path: str, questions: list) -> list:
+    chunks, embedding_matrix = get_repo_index(repo_path)
+    ranked = get_top_k_chunks_batch(questions, chunks, k=5, embedding_matrix=embedding_matrix)
+    with span("expand"):
+        graph = get_repo_graph(repo_path)
+        return [expand_with_references(top_chunks, chunks, graph) for top_chunks in ranked]
+
+# Retrieval without generation, for agents that reason over the code with their own model
+def retrieve_chunks(repo_path: str, query: str, max_tokens: int = 4000, k: int = 20, paths: list = None,
+                    expand_references: bool = True) -> dict:
+    """
+    The best chunks for the query, best first, expanded with the definitions they reference, within max_tokens.
+    Chunks that do not fit the budget are skipped, so a smaller one ranked later can still be included.
+    """
+    with span("retrieve_chunks"):
+        chunks, embedding_matrix = get_repo_index(repo_path)
+        with span("embed_query"):
+            query_emb = get_embedding(query)
+        with span("retrieve"):
+            if paths:
+                chunk_ids = [chunk_id for chunk_id, chunk in enumerate(chunks) if matches_paths(chunk.get("file", ""), paths)]
+                ranked = rank_chunks(query_emb, [chunks[chunk_id] for chunk_id in chunk_ids], k=k,
+                                     embedding_matrix=embedding_matrix[chunk_ids] if chunk_ids else None)
+                for result in ranked:
+                    result["id"] = chunk_ids[result["id"]]
+            else:
+                ranked = rank_chunks(query_emb, chunks, k=k, embedding_matrix=embedding_matrix)
+        if expand_references:
+            with span("expand"):
+                ranked = expand_with_references(ranked, chunks, get_repo_graph(repo_path))
 
+        results = []
+        total_tokens = 0
+        for result in ranked:
+            tokens = chunk_tokens(chunks[result["id"]])
+            if total_tokens + tokens > max_tokens:
+                continue
+            total_tokens += tokens
+            result["score"] = result.pop("similarity")
+            result["tokens"] = tokens
+            results.append(result)
+        return {"chunks": results, "total_tokens": total_tokens, "omitted": len(ranked) - len(results)}
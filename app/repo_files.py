@@ -0,0 +1,387 @@
+# --- app/repo_files.py ---
+import base64
+import bisect
+import fnmatch
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Never listed, whatever the ignore rules say
+ALWAYS_IGNORED = {".git"}
+# Filtered listings kept per snapshot, keyed by (glob, max_depth)
+MAX_CACHED_LISTINGS = 16
+# Rebuilds whose changes each snapshot remembers, for changes_since; older versions get None
+MAX_CACHED_CHANGES = 64
+# Directory listings and file stats are trusted for MCP_SNAPSHOT_TTL seconds, then checked again against mtimes
+SNAPSHOT_TTL = float(os.getenv("MCP_SNAPSHOT_TTL", "1"))
+# Recently read file contents are kept up to MCP_SNAPSHOT_CACHE_BYTES in total, shared by all tools and repos.
+# Files larger than MCP_SNAPSHOT_MAX_FILE_BYTES are not cached; callers memory-map them instead
+SNAPSHOT_CACHE_BYTES = int(os.getenv("MCP_SNAPSHOT_CACHE_BYTES", str(64 * 1024 * 1024)))
+SNAPSHOT_MAX_FILE_BYTES = int(os.getenv("MCP_SNAPSHOT_MAX_FILE_BYTES", str(1024 * 1024)))
+# Shared by search_in_repo, its trigram index and read_file, so what they skip never drifts apart:
+# files larger than MCP_SEARCH_MAX_FILE_BYTES are not searched, and files with a NUL byte in their first
+# BINARY_SNIFF_BYTES are binary
+SEARCH_MAX_FILE_BYTES = int(os.getenv("MCP_SEARCH_MAX_FILE_BYTES", str(20 * 1024 * 1024)))
+BINARY_SNIFF_BYTES = 8192
+
+
+def is_binary(data) -> bool:
+    """Whether the file's bytes (or mmap) have a NUL byte in their first BINARY_SNIFF_BYTES."""
+    return data.find(b"\0", 0, BINARY_SNIFF_BYTES) != -1
+
+
+def translate_gitignore(pattern: str) -> str:
+    """
+    Regex of a gitignore glob, with git's rules rather than fnmatch's: "*", "?" and "[...]" never match "/",
+    a leading "**/" and a middle "/**/" match zero or more directories, and a trailing "/**" everything inside.
+    """
+    parts, i, n = [], 0, len(pattern)
+    while i < n:
+        char = pattern[i]
+        if pattern.startswith("**", i) and (i == 0 or pattern[i - 1] == "/"):
+            if i + 2 == n:
+                parts.append(".*")
+                i += 2
+                continue
+            if pattern[i + 2] == "/":
+                parts.append("(?:.*/)?")
+                i += 3
+                continue
+        if char == "*":
+            parts.append("[^/]*")
+        elif char == "?":
+            parts.append("[^/]")
+        elif char == "\\" and i + 1 < n:
+            i += 1
+            parts.append(re.escape(pattern[i]))
+        elif char == "[":
+            # A "]" right after "[" (or "[!") is part of the class
+            start = i + 2 if pattern[i + 1:i + 2] in ("!", "^") else i + 1
+            end = pattern.find("]", start + 1 if pattern[start:start + 1] == "]" else start)
+            if end == -1:
+                parts.append(re.escape(char))
+            else:
+                body = pattern[i + 1:end]
+                negate = body[:1] in ("!", "^")
+                body = body[1:] if negate else body
+                body = body.replace("\\", "\\\\").replace("^", "\\^").replace("[", "\\[")
+                parts.append(f"[^/{body}]" if negate else f"(?!/)[{body}]")
+                i = end
+        else:
+            parts.append(re.escape(char))
+        i += 1
+    return f"(?s:{''.join(parts)})\\Z"
+
+
+def parse_gitignore(text: str, base: str) -> list:
+    """
+    Rules of a .gitignore file in directory base (relative to the repo root, "" for the root), as
+    (base, regex, negate, dir_only, anchored). Supports comments, negation, trailing "/" for directories,
+    patterns anchored by a "/", and "**", matched with git's rules (translate_gitignore). Later rules win, as in git.
+    """
+    rules = []
+    for line in text.splitlines():
+        line = line.rstrip()
+        if not line or line.startswith("#"):
+            continue
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        anchored = "/" in line
+        line = line.lstrip("/")
+        if not line:
+            continue
+        rules.append((base, re.compile(translate_gitignore(line)), negate, dir_only, anchored))
+    return rules
+
+
+def is_ignored(rel_path: str, is_dir: bool, rules: list) -> bool:
+    ignored = False
+    name = rel_path.rsplit("/", 1)[-1]
+    for base, regex, negate, dir_only, anchored in rules:
+        if dir_only and not is_dir:
+            continue
+        if anchored:
+            path = rel_path[len(base) + 1:] if base else rel_path
+            matched = regex.match(path)
+        else:
+            matched = regex.match(name)
+        if matched:
+            ignored = not negate
+    return ignored
+
+
+def matches_paths(file_path: str, paths: list) -> bool:
+    """Glob patterns match the whole relative path; plain paths match the file or everything below the directory."""
+    for pattern in paths:
+        pattern = pattern.replace("\\", "/").strip("/")
+        if fnmatch.fnmatch(file_path, pattern) or file_path == pattern or file_path.startswith(pattern + "/"):
+            return True
+    return False
+
+
+class FileCache:
+    """
+    Stat data and a bounded LRU of the contents of recently read files, by absolute path.
+    A stat is reused for SNAPSHOT_TTL seconds; cached contents are served while the file's mtime and size are unchanged.
+    """
+    def __init__(self, max_bytes: int, max_file_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.ttl = ttl
+        self._stats = {}
+        self._contents = OrderedDict()
+        self._cached_bytes = 0
+        self._counts = {"stat_calls": 0, "stat_hits": 0, "reads": 0, "read_hits": 0}
+        self._lock = threading.Lock()
+
+    def stat(self, path: str):
+        """(mtime_ns, size) of the file; raises OSError if it does not exist."""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._stats.get(path)
+            if cached is not None and now - cached[2] < self.ttl:
+                self._counts["stat_hits"] += 1
+                return cached[:2]
+            self._counts["stat_calls"] += 1
+        try:
+            stat = os.stat(path)
+        except OSError:
+            with self._lock:
+                self._stats.pop(path, None)
+            raise
+        with self._lock:
+            self._stats[path] = (stat.st_mtime_ns, stat.st_size, now)
+        return stat.st_mtime_ns, stat.st_size
+
+    def read_bytes(self, path: str) -> bytes:
+        mtime, size = self.stat(path)
+        with self._lock:
+            cached = self._contents.get(path)
+            if cached is not None and cached[:2] == (mtime, size):
+                self._contents.move_to_end(path)
+                self._counts["read_hits"] += 1
+                return cached[2]
+            self._counts["reads"] += 1
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) <= self.max_file_bytes:
+            with self._lock:
+                previous = self._contents.pop(path, None)
+                if previous is not None:
+                    self._cached_bytes -= len(previous[2])
+                self._contents[path] = (mtime, len(data), data)
+                self._cached_bytes += len(data)
+                while self._cached_bytes > self.max_bytes:
+                    _, (_, _, evicted) = self._contents.popitem(last=False)
+                    self._cached_bytes -= len(evicted)
+        return data
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self._counts, cached_files=len(self._contents), cached_bytes=self._cached_bytes)
+
+
+file_cache = FileCache(SNAPSHOT_CACHE_BYTES, SNAPSHOT_MAX_FILE_BYTES, SNAPSHOT_TTL)
+
+
+class DirectorySnapshot:
+    """
+    The files of a repository, kept in memory and shared by all tools. Each directory's entries are cached with
+    its mtime, which changes whenever an entry is added, removed or renamed, so a refresh (at most every
+    SNAPSHOT_TTL seconds) only stats the directories (and .gitignore files) and re-reads the ones that changed.
+    Each rebuild bumps version and records which files it added, removed or saw in changed directories.
+    File stats and contents are served through the shared file_cache.
+    """
+    def __init__(self, root: str, respect_ignore: bool = True):
+        self.root = root
+        self.respect_ignore = respect_ignore
+        # Relative directory -> (mtime_ns, subdirectory names, file names), for every directory listed
+        self._entries = {}
+        # Relative directory -> mtime_ns of its .gitignore, or None if it has none
+        self._gitignores = {}
+        self._paths = []
+        self._listings = {}
+        self._changes = deque(maxlen=MAX_CACHED_CHANGES)
+        self.version = 0
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _full_path(self, rel_dir: str) -> str:
+        return os.path.join(self.root, rel_dir) if rel_dir else self.root
+
+    def _gitignore_mtime(self, rel_dir: str):
+        try:
+            return os.stat(os.path.join(self._full_path(rel_dir), ".gitignore")).st_mtime_ns
+        except OSError:
+            return None
+
+    def _is_stale(self) -> bool:
+        if not self._entries:
+            return True
+        for rel_dir, (mtime, _, _) in self._entries.items():
+            try:
+                if os.stat(self._full_path(rel_dir)).st_mtime_ns != mtime:
+                    return True
+            except OSError:
+                return True
+            if self.respect_ignore and self._gitignore_mtime(rel_dir) != self._gitignores.get(rel_dir):
+                return True
+        return False
+
+    def _read_dir(self, rel_dir: str):
+        cached = self._entries.get(rel_dir)
+        full_path = self._full_path(rel_dir)
+        mtime = os.stat(full_path).st_mtime_ns
+        if cached is not None and cached[0] == mtime:
+            return cached
+        subdirs, files = [], []
+        with os.scandir(full_path) as entries:
+            for entry in entries:
+                if entry.name in ALWAYS_IGNORED:
+                    continue
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+                (subdirs if is_dir else files).append(entry.name)
+        return mtime, subdirs, files
+
+    def _rebuild(self):
+        entries, gitignores, paths = {}, {}, []
+        stack = [("", [])]
+        while stack:
+            rel_dir, rules = stack.pop()
+            try:
+                entries[rel_dir] = self._read_dir(rel_dir)
+            except OSError:
+                continue
+            _, subdirs, files = entries[rel_dir]
+            if self.respect_ignore:
+                gitignores[rel_dir] = self._gitignore_mtime(rel_dir)
+                if gitignores[rel_dir] is not None:
+                    with open(os.path.join(self._full_path(rel_dir), ".gitignore"), encoding="utf-8", errors="ignore") as f:
+                        rules = rules + parse_gitignore(f.read(), rel_dir)
+            for name in files:
+                rel_path = f"{rel_dir}/{name}" if rel_dir else name
+                if not (rules and is_ignored(rel_path, False, rules)):
+                    paths.append(rel_path)
+            for name in subdirs:
+                rel_path = f"{rel_dir}/{name}" if rel_dir else name
+                if not (rules and is_ignored(rel_path, True, rules)):
+                    stack.append((rel_path, rules))
+        paths.sort()
+        if self.version:
+            old_paths, new_paths = set(self._paths), set(paths)
+            # Files of re-read directories may have been replaced by a rename without their path changing
+            touched = set()
+            for rel_dir, (mtime, _, files) in entries.items():
+                cached = self._entries.get(rel_dir)
+                if cached is None or cached[0] != mtime:
+                    touched.update(f"{rel_dir}/{name}" if rel_dir else name for name in files)
+            self._changes.append((self.version + 1, new_paths - old_paths, old_paths - new_paths,
+                                  touched & old_paths & new_paths))
+        self._entries, self._gitignores, self._paths = entries, gitignores, paths
+        self._listings = {}
+        self.version += 1
+
+    def refresh(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._checked_at < SNAPSHOT_TTL:
+                return
+            if self._is_stale():
+                self._rebuild()
+            self._checked_at = now
+
+    def changes_since(self, version: int):
+        """
+        (current version, changes), changes being the (added, removed, touched) file sets since version, touched
+        the files still listed whose directory changed; None if they are no longer remembered (or version is 0).
+        """
+        self.refresh()
+        with self._lock:
+            added, removed, touched = set(), set(), set()
+            if version == self.version:
+                return self.version, (added, removed, touched)
+            if not version or not self._changes or self._changes[0][0] > version + 1:
+                return self.version, None
+            for change_version, change_added, change_removed, change_touched in self._changes:
+                if change_version <= version:
+                    continue
+                added = (added - change_removed) | change_added
+                removed = (removed - change_added) | change_removed
+                touched |= change_touched
+            touched -= added | removed
+            return self.version, (added, removed, touched)
+
+    def full_path(self, rel_path: str) -> str:
+        return os.path.join(self.root, rel_path)
+
+    def stat(self, rel_path: str):
+        """(mtime_ns, size) of a file of the repo; raises OSError if it does not exist."""
+        return file_cache.stat(self.full_path(rel_path))
+
+    def read_bytes(self, rel_path: str) -> bytes:
+        return file_cache.read_bytes(self.full_path(rel_path))
+
+    def list(self, glob: str = None, max_depth: int = None) -> list:
+        """All files, sorted, as paths relative to the root with "/" separators."""
+        self.refresh()
+        with self._lock:
+            key = (glob, max_depth)
+            if key not in self._listings:
+                paths = self._paths
+                if max_depth is not None:
+                    paths = [path for path in paths if path.count("/") <= max_depth]
+                if glob:
+                    regex = re.compile(fnmatch.translate(glob))
+                    paths = [path for path in paths if regex.match(path)]
+                if len(self._listings) >= MAX_CACHED_LISTINGS:
+                    self._listings.pop(next(iter(self._listings)))
+                self._listings[key] = paths
+            return self._listings[key]
+
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def get_snapshot(repo_path: str, respect_ignore: bool = True) -> DirectorySnapshot:
+    key = (os.path.realpath(repo_path), respect_ignore)
+    with _snapshots_lock:
+        if key not in _snapshots:
+            _snapshots[key] = DirectorySnapshot(key[0], respect_ignore)
+        return _snapshots[key]
+
+
+def encode_cursor(path: str) -> str:
+    return base64.urlsafe_b64encode(path.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> str:
+    try:
+        return base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+    except (ValueError, UnicodeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def list_repo_files(repo_path: str, cursor: str = None, limit: int = 1000, glob: str = None, max_depth: int = None,
+                    respect_ignore: bool = True) -> dict:
+    """
+    One page of the repository's files, in path order. The cursor is the last path of the previous page,
+    so pages stay consistent when files are added or removed in between.
+    """
+    paths = get_snapshot(repo_path, respect_ignore).list(glob, max_depth)
+    start = bisect.bisect_right(paths, decode_cursor(cursor)) if cursor else 0
+    page = paths[start:start + max(1, limit)]
+    has_more = start + len(page) < len(paths)
+    return {
+        "files": page,
+        "total": len(paths),
+        "next_cursor": encode_cursor(page[-1]) if has_more else None,
+    }
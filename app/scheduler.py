@@ -0,0 +1,213 @@
+# --- app/scheduler.py ---
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from concurrent.futures import CancelledError
+from contextlib import contextmanager
+from contextvars import ContextVar
+from app.metrics import add_gauge, inc_counter, observe
+
+# Process-wide budgets shared by every OpenAI call (index builds, query embeddings, completions).
+# 0 disables a budget. Token costs are estimated before the call and corrected from the response usage.
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", "3000"))
+OPENAI_TPM = float(os.getenv("OPENAI_TPM", "1000000"))
+# Retries are done here rather than by the client, so they queue behind the budgets like any other call
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "8"))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "30"))
+
+# Lower value is served first; within a class calls are served in arrival order
+PRIORITIES = {"interactive": 0, "background": 1}
+_priority = ContextVar("openai_priority", default="interactive")
+# Event set once the result of the calls made in this context is no longer wanted (e.g. a losing hedge)
+_cancelled = ContextVar("openai_cancelled", default=None)
+
+
+@contextmanager
+def priority(name: str):
+    """Schedule the OpenAI calls made inside this block with the given priority class."""
+    if name not in PRIORITIES:
+        raise ValueError(f"Unknown priority class: {name}")
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def set_cancel_event(event: threading.Event):
+    """Stop the OpenAI calls of the current context from being sent or retried once event is set."""
+    _cancelled.set(event)
+
+
+class TokenBucketScheduler:
+    """
+    Two token buckets (requests and tokens per minute) refilled continuously, with a single queue
+    ordered by (priority class, arrival). Only the head of the queue may take from the buckets,
+    so a large background batch never overtakes an interactive call, and after a rate-limit
+    pause the queue drains at the budgeted rate instead of all at once.
+    """
+    def __init__(self, rpm: float, tpm: float):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = rpm
+        self._tokens = tpm
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._queue = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def _refill(self, now: float):
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    def _seconds_until_available(self, now: float, tokens: float) -> float:
+        wait = self._paused_until - now
+        if self.rpm and self._requests < 1:
+            wait = max(wait, (1 - self._requests) * 60 / self.rpm)
+        if self.tpm and self._tokens < tokens:
+            wait = max(wait, (tokens - self._tokens) * 60 / self.tpm)
+        return wait
+
+    def acquire(self, tokens: float, priority_class: str = None, deadline: float = None) -> float:
+        """
+        Block until the call may be sent, returning the seconds spent waiting.
+        Raises TimeoutError if it cannot be sent before deadline (a time.monotonic() instant).
+        """
+        priority_class = priority_class or _priority.get()
+        # A call larger than the whole budget waits for a full bucket instead of forever
+        tokens = min(tokens, self.tpm) if self.tpm else 0
+        entry = (PRIORITIES[priority_class], next(self._sequence))
+        start_time = time.monotonic()
+        add_gauge("mcp_openai_queue_depth", 1, priority=priority_class)
+        with self._condition:
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    wait = self._seconds_until_available(now, tokens)
+                    if self._queue[0] == entry and wait <= 0:
+                        heapq.heappop(self._queue)
+                        if self.rpm:
+                            self._requests -= 1
+                        self._tokens -= tokens
+                        self._condition.notify_all()
+                        break
+                    if deadline is not None and now >= deadline:
+                        raise TimeoutError("OpenAI call not sent before its deadline")
+                    # Waiters behind the head only need to wake when the head is served
+                    wait = wait if self._queue[0] == entry else None
+                    if deadline is not None:
+                        wait = deadline - now if wait is None else min(wait, deadline - now)
+                    self._condition.wait(wait)
+            except BaseException:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._condition.notify_all()
+                raise
+            finally:
+                add_gauge("mcp_openai_queue_depth", -1, priority=priority_class)
+        waited = time.monotonic() - start_time
+        observe("mcp_openai_queue_wait_seconds", waited, priority=priority_class)
+        return waited
+
+    def settle(self, estimated_tokens: float, actual_tokens: float):
+        """Correct the token bucket once the real cost of a call is known."""
+        if not self.tpm:
+            return
+        with self._condition:
+            self._tokens = min(self.tpm, self._tokens + min(estimated_tokens, self.tpm) - actual_tokens)
+            self._condition.notify_all()
+
+    def pause(self, seconds: float):
+        """Hold back every queued call, after the provider signalled we are over its limits."""
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._condition.notify_all()
+
+    def get_stats(self) -> dict:
+        with self._condition:
+            self._refill(time.monotonic())
+            return {
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "available_requests": self._requests if self.rpm else None,
+                "available_tokens": self._tokens if self.tpm else None,
+                "queued": len(self._queue),
+                "paused_seconds": max(0.0, self._paused_until - time.monotonic()),
+            }
+
+
+scheduler = TokenBucketScheduler(OPENAI_RPM, OPENAI_TPM)
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly 4 characters per token for English text and code
+    return len(text) // 4 + 1
+
+
+def _retry_delay(error, attempt: int):
+    """Seconds to wait before retrying the failed call, or None if it should not be retried."""
+    import openai
+    if not isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)):
+        return None
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        # Full jitter, so callers that failed together do not retry together
+        return random.uniform(0, min(OPENAI_BACKOFF_MAX, OPENAI_BACKOFF_BASE * 2 ** attempt))
+
+
+def _check_cancelled():
+    event = _cancelled.get()
+    if event is not None and event.is_set():
+        raise CancelledError("OpenAI call no longer wanted")
+
+
+def call_openai(create, estimated_tokens: float, deadline: float = None, **kwargs):
+    """
+    Call an OpenAI client method, e.g. client.embeddings.create, through the shared scheduler,
+    retrying rate limits, connection errors and server errors with jittered exponential backoff.
+    With a deadline (a time.monotonic() instant), each attempt gets the time left as its timeout and
+    nothing is sent or retried after it: TimeoutError is raised instead.
+    """
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        _check_cancelled()
+        scheduler.acquire(estimated_tokens, deadline=deadline)
+        if deadline is not None:
+            kwargs["timeout"] = deadline - time.monotonic()
+            if kwargs["timeout"] <= 0:
+                scheduler.settle(estimated_tokens, 0)
+                raise TimeoutError("OpenAI call not sent before its deadline")
+        try:
+            response = create(**kwargs)
+        except Exception as e:
+            scheduler.settle(estimated_tokens, 0)
+            delay = _retry_delay(e, attempt)
+            if delay is None or attempt == OPENAI_MAX_RETRIES:
+                raise
+            if type(e).__name__ == "RateLimitError":
+                # Every queued call waits out the limit, not just this one
+                scheduler.pause(delay)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                # A timed-out attempt is not retried either: the deadline has passed or would before the retry
+                raise TimeoutError("OpenAI call cannot be retried before its deadline") from e
+            inc_counter("mcp_openai_retries_total", error=type(e).__name__)
+            if type(e).__name__ != "RateLimitError":
+                time.sleep(delay)
+            continue
+        usage = getattr(response, "usage", None)
+        actual_tokens = getattr(usage, "total_tokens", None)
+        scheduler.settle(estimated_tokens, estimated_tokens if actual_tokens is None else actual_tokens)
+        return response
@@ -0,0 +1,164 @@
+# --- app/search.py ---
+import base64
+import bisect
+import json
+import mmap
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app.metrics import span
+from app.repo_files import SEARCH_MAX_FILE_BYTES, file_cache, get_snapshot, is_binary
+from app.trigram_index import TRIGRAM_INDEX_ENABLED, get_trigram_index
+
+SEARCH_THREADS = int(os.getenv("MCP_SEARCH_THREADS", str(min(32, (os.cpu_count() or 1) * 4))))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=SEARCH_THREADS, thread_name_prefix="search")
+    return _executor
+
+
+def compile_query(query: str, regex: bool = False, case_sensitive: bool = True):
+    """Compile the query to a bytes pattern; raises re.error for an invalid regex."""
+    pattern = query.encode("utf-8") if regex else re.escape(query.encode("utf-8"))
+    return re.compile(pattern, re.MULTILINE | (0 if case_sensitive else re.IGNORECASE))
+
+
+def encode_cursor(file: str, line: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([file, line]).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str):
+    try:
+        file, line = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return file, int(line)
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def _decode_line(data) -> str:
+    return bytes(data).decode("utf-8", errors="replace").rstrip("\r\n")
+
+
+def _context(data, line_start: int, line_end: int, lines: int):
+    before, start = [], line_start
+    for _ in range(lines):
+        if start == 0:
+            break
+        previous = data.rfind(b"\n", 0, start - 1) + 1
+        before.insert(0, _decode_line(data[previous:start]))
+        start = previous
+    after, end = [], line_end
+    for _ in range(lines):
+        if end >= len(data):
+            break
+        next_end = data.find(b"\n", end)
+        next_end = len(data) if next_end == -1 else next_end + 1
+        after.append(_decode_line(data[end:next_end]))
+        end = next_end
+    return before, after
+
+
+def search_file(full_path: str, pattern, max_matches: int, after_line: int = 0, context_lines: int = 0) -> list:
+    """
+    Matching lines of one file as (line number, line, before, after), at most one per line and at most max_matches,
+    skipping lines up to after_line. Small files come from the shared file cache; larger ones are memory-mapped,
+    so only the pages scanned are read.
+    """
+    try:
+        _, size = file_cache.stat(full_path)
+        if size == 0 or size > SEARCH_MAX_FILE_BYTES:
+            return []
+        if size <= file_cache.max_file_bytes:
+            return _search_buffer(file_cache.read_bytes(full_path), pattern, max_matches, after_line, context_lines)
+        with open(full_path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return _search_buffer(mm, pattern, max_matches, after_line, context_lines)
+    except (OSError, ValueError):
+        return []
+
+
+def _search_buffer(data, pattern, max_matches: int, after_line: int, context_lines: int) -> list:
+    if is_binary(data):
+        return []
+    matches = []
+    line_number, counted_to = 1, 0
+    position = 0
+    while len(matches) < max_matches:
+        match = pattern.search(data, position)
+        if match is None:
+            break
+        line_start = data.rfind(b"\n", 0, match.start()) + 1
+        line_end = data.find(b"\n", match.start())
+        line_end = len(data) if line_end == -1 else line_end + 1
+        line_number += data[counted_to:line_start].count(b"\n")
+        counted_to = line_start
+        if line_number > after_line:
+            before, after = _context(data, line_start, line_end, context_lines) if context_lines else ([], [])
+            matches.append((line_number, _decode_line(data[line_start:line_end]), before, after))
+        # One result per line; an empty match must still move forward
+        position = max(line_end, match.end(), position + 1)
+        if position > len(data):
+            break
+    return matches
+
+
+def search_repo(repo_path: str, query: str, regex: bool = False, case_sensitive: bool = True, limit: int = 200,
+                context_lines: int = 0, glob: str = None, cursor: str = None) -> dict:
+    """
+    Matching lines in the repository's files (in path order, skipping binaries, .git and ignored files), at most limit.
+    Files are searched in parallel a window at a time, and the search stops as soon as the limit is reached.
+    When it is, next_cursor continues the search after the last match returned (the next page may be empty).
+    """
+    with span("search"):
+        pattern = compile_query(query, regex, case_sensitive)
+        limit = max(1, limit)
+        root = os.path.realpath(repo_path)
+        files = get_snapshot(repo_path).list(glob)
+        if TRIGRAM_INDEX_ENABLED:
+            # Only verify the files that contain every trigram the query requires
+            candidates = get_trigram_index(repo_path).candidates(pattern)
+            if candidates is not None:
+                # Both lists are sorted: look each candidate up rather than building a set of every file
+                positions = [bisect.bisect_left(files, file) for file in candidates]
+                files = [file for file, i in zip(candidates, positions) if i < len(files) and files[i] == file]
+        start, after_line = 0, {}
+        if cursor:
+            cursor_file, cursor_line = decode_cursor(cursor)
+            start = bisect.bisect_left(files, cursor_file)
+            after_line = {cursor_file: cursor_line}
+
+        executor = _get_executor()
+        window = SEARCH_THREADS * 4
+        matches = []
+        searched = 0
+        position = start
+        pending = []
+        while (position < len(files) or pending) and len(matches) < limit:
+            while position < len(files) and len(pending) < window:
+                file = files[position]
+                pending.append((file, executor.submit(search_file, os.path.join(root, file), pattern, limit,
+                                                      after_line.get(file, 0), context_lines)))
+                position += 1
+            file, future = pending.pop(0)
+            searched += 1
+            for line_number, line, before, after in future.result()[:limit - len(matches)]:
+                match = {"file": file, "line": line_number, "content": line}
+                if context_lines:
+                    match["before"], match["after"] = before, after
+                matches.append(match)
+        # Stop early: files queued beyond the limit are not searched
+        for _, future in pending:
+            future.cancel()
+
+        truncated = len(matches) == limit
+        result = {"matches": matches, "files_searched": searched, "truncated": truncated}
+        result["next_cursor"] = encode_cursor(matches[-1]["file"], matches[-1]["line"]) if truncated else None
+        return result
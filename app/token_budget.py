@@ -0,0 +1,151 @@
+# --- app/token_budget.py ---
+import json
+import os
+from collections import Counter
+from app.utils import count_tokens
+
+# Token budget of a tool response when the call does not pass max_tokens; 0 for no limit.
+# Tokens are counted with the tokenizer of the index (app.utils.count_tokens), on the JSON the client receives.
+TOOL_MAX_TOKENS = int(os.getenv("MCP_TOOL_MAX_TOKENS", "25000"))
+# Share of a head/tail window given to the head; the rest shows the end
+HEAD_SHARE = 0.75
+
+
+def resolve_budget(max_tokens: int = None):
+    """The budget of a call: max_tokens, else MCP_TOOL_MAX_TOKENS, or None for no limit."""
+    budget = TOOL_MAX_TOKENS if max_tokens is None else max_tokens
+    return budget if budget and budget > 0 else None
+
+
+def json_tokens(value) -> int:
+    return count_tokens(json.dumps(value, ensure_ascii=False))
+
+
+def _cut_line(line: str, budget: int, tokens: int) -> str:
+    # A single line over the budget is cut in proportion of its characters
+    return line[:max(1, len(line) * budget // max(tokens, 1))]
+
+
+def clip_text(text: str, budget: int):
+    """
+    The text if it fits in budget tokens, else its first and last whole lines that fit (HEAD_SHARE of the budget
+    for the head) around an omission marker. Returns (text, head lines, tail lines), the line counts None if unclipped.
+    """
+    tokens = count_tokens(text)
+    if tokens <= budget:
+        return text, None, None
+    lines = text.splitlines(keepends=True)
+    counts = [count_tokens(line) for line in lines]
+    head, used = 0, 0
+    while head < len(lines) and used + counts[head] <= budget * HEAD_SHARE:
+        used += counts[head]
+        head += 1
+    tail = 0
+    while head + tail < len(lines) and used + counts[-1 - tail] <= budget:
+        used += counts[-1 - tail]
+        tail += 1
+    if head == 0 and tail == 0:
+        return _cut_line(lines[0], budget, counts[0]), 0, 0
+    marker = f"... [{len(lines) - head - tail} lines omitted] ...\n"
+    return "".join(lines[:head]) + marker + "".join(lines[len(lines) - tail:]), head, tail
+
+
+def take_within(items: list, budget: int) -> int:
+    """Number of leading items whose JSON fits in budget tokens, at least one."""
+    used = 0
+    for count, item in enumerate(items):
+        used += json_tokens(item)
+        if used > budget:
+            return max(count, 1)
+    return len(items)
+
+
+def fit_file(result: dict, max_tokens: int = None) -> dict:
+    """
+    A read_file result within the budget: the head and tail of its content, with the omitted lines (or bytes,
+    for a byte range or a first line too long on its own) reported, and where to continue reading from.
+    """
+    budget = resolve_budget(max_tokens)
+    if budget is None or "content" not in result:
+        return result
+    lines = result["content"].splitlines(keepends=True)
+    content, head, tail = clip_text(result["content"], budget)
+    if head is None:
+        return result
+    clipped = dict(result, content=content, truncated=True)
+    if "byte_offset" in result or head == tail == 0:
+        # A first line over the budget on its own is continued by bytes, after the part of it returned
+        offset = result.get("byte_offset", result.get("start_byte", 0))
+        length = result.get("byte_length", len(result["content"].encode("utf-8")))
+        head_bytes = len(content.encode("utf-8")) if head == tail == 0 else len("".join(lines[:head]).encode("utf-8"))
+        tail_bytes = len("".join(lines[len(lines) - tail:]).encode("utf-8"))
+        start = offset + head_bytes
+        clipped["omitted_bytes"] = [start, offset + length - tail_bytes]
+        clipped["next_byte_offset"] = start
+    else:
+        first = result.get("start_line", 1)
+        clipped["omitted_lines"] = [first + head, first + len(lines) - tail - 1]
+        clipped["next_start_line"] = first + head
+    return clipped
+
+
+def fit_list(result: dict, key: str, max_tokens: int = None, cursor_of=None, count_by: str = None,
+             clip_key: str = None) -> dict:
+    """
+    A result with a list of items under key, cut to the leading items that fit in the budget.
+    The number of omitted items is reported, per value of their count_by field if given (e.g. matches per file),
+    and cursor_of(last item kept) gives next_cursor to continue after it. If even the first item does not fit,
+    it is kept with its clip_key text clipped to the budget.
+    """
+    budget = resolve_budget(max_tokens)
+    items = result[key]
+    if budget is None or not items or json_tokens(result) <= budget:
+        return result
+    kept = items[:take_within(items, budget)]
+    if len(kept) == len(items) and not (clip_key and json_tokens(kept[0]) > budget):
+        return result
+    if clip_key and json_tokens(kept[0]) > budget:
+        kept[0] = dict(kept[0], **{clip_key: clip_text(kept[0][clip_key], budget)[0]}, clipped=True)
+
+    def cut(kept: list) -> dict:
+        omitted = items[len(kept):]
+        clipped = dict(result, **{key: kept}, truncated=True, omitted=len(omitted))
+        if count_by and omitted:
+            # Most omitted first, within a quarter of the budget; the rest are only counted
+            counts, used = {}, 0
+            ranked = sorted(Counter(item[count_by] for item in omitted).items(), key=lambda entry: (-entry[1], entry[0]))
+            for value, count in ranked:
+                used += json_tokens({value: count})
+                if used > budget // 4:
+                    break
+                counts[value] = count
+            clipped[f"omitted_per_{count_by}"] = counts
+            if len(counts) < len(ranked):
+                clipped[f"{count_by}s_not_listed"] = len(ranked) - len(counts)
+        if cursor_of is not None and omitted:
+            clipped["next_cursor"] = cursor_of(kept[-1])
+        return clipped
+
+    # The summary of the omitted items counts against the budget too: drop more items until it fits
+    clipped = cut(kept)
+    over = json_tokens(clipped) - budget
+    while over > 0 and len(kept) > 1:
+        while over > 0 and len(kept) > 1:
+            over -= json_tokens(kept.pop())
+        clipped = cut(kept)
+        over = json_tokens(clipped) - budget
+    return clipped
+
+
+def fit_answer(result: dict, max_tokens: int = None) -> dict:
+    """An ask_question result within the budget: its answer clipped to a head and tail, or as many fallback chunks as fit."""
+    budget = resolve_budget(max_tokens)
+    if budget is None:
+        return result
+    if result.get("answer"):
+        answer, head, _ = clip_text(result["answer"], budget)
+        if head is not None:
+            result = dict(result, answer=answer, truncated=True)
+    if result.get("chunks"):
+        result = fit_list(result, "chunks", budget, clip_key="content")
+    return result
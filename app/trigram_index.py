@@ -0,0 +1,321 @@
+# --- app/trigram_index.py ---
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from re import _parser as sre_parse
+from app.metrics import span
+from app.repo_files import SEARCH_MAX_FILE_BYTES, file_cache, get_snapshot, is_binary
+
+# Set MCP_TRIGRAM_INDEX=1 to narrow search_in_repo to the files containing the query's trigrams.
+# The index of each repo is saved under MCP_TRIGRAM_INDEX_DIR and brought up to date incrementally from the
+# directory snapshot's changes: files added, removed or in a changed directory are re-checked on every search.
+# Files edited in place leave their directory unchanged, so each search also re-stats, in turn, the share of the
+# files due since the last one: every file is re-checked about once every MCP_TRIGRAM_REFRESH_SECONDS.
+TRIGRAM_INDEX_ENABLED = os.getenv("MCP_TRIGRAM_INDEX", "0") == "1"
+TRIGRAM_INDEX_DIR = os.getenv("MCP_TRIGRAM_INDEX_DIR", "trigram_indexes")
+TRIGRAM_REFRESH_SECONDS = float(os.getenv("MCP_TRIGRAM_REFRESH_SECONDS", "2"))
+TRIGRAM_SAVE_SECONDS = float(os.getenv("MCP_TRIGRAM_SAVE_SECONDS", "60"))
+TRIGRAM_INDEX_VERSION = 1
+
+
+def file_trigrams(data: bytes) -> "np.ndarray":
+    """Sorted distinct trigrams of the ASCII-lower-cased bytes, packed into uint32s."""
+    import numpy as np
+    if len(data) < 3:
+        return np.zeros(0, dtype=np.uint32)
+    values = np.frombuffer(data.lower(), dtype=np.uint8).astype(np.uint32)
+    return np.unique((values[:-2] << 16) | (values[1:-1] << 8) | values[2:])
+
+
+def query_plan(pattern) -> list:
+    """
+    What a compiled bytes pattern requires of a matching file, as a list of terms that must all hold:
+    a bytes literal that must occur, or ("or", [plans]) for an alternation. An empty plan requires nothing.
+    """
+    return _plan(sre_parse.parse(pattern.pattern, pattern.flags))
+
+
+def _plan(sequence) -> list:
+    terms, run = [], bytearray()
+
+    def flush():
+        if len(run) >= 3:
+            terms.append(bytes(run))
+        run.clear()
+
+    for op, value in sequence:
+        if op is sre_parse.LITERAL:
+            run.append(value)
+            continue
+        flush()
+        if op is sre_parse.SUBPATTERN:
+            terms.extend(_plan(value[-1]))
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, sre_parse.POSSESSIVE_REPEAT):
+            minimum, _, subpattern = value
+            if minimum >= 1:
+                terms.extend(_plan(subpattern))
+        elif op is sre_parse.BRANCH:
+            branches = [_plan(branch) for branch in value[1]]
+            # A branch that requires nothing lets every file match
+            if all(branches):
+                terms.append(("or", branches))
+    flush()
+    return terms
+
+
+class TrigramIndex:
+    """
+    Posting lists from trigram to file id, stored as two arrays sorted by trigram (merged files), plus the
+    files added since the last merge, which are checked one by one. Changed and removed files are marked dead
+    and dropped at the next merge, which happens once the unmerged files outnumber an eighth of the index.
+    """
+    def __init__(self, root: str, path: str):
+        import numpy as np
+        self.root = root
+        self.path = path
+        self.files = []       # file id -> relative path, None once dead
+        self.stats = []       # file id -> (mtime_ns, size)
+        self.trigrams = []    # file id -> sorted trigram array
+        self.by_path = {}
+        self.dead = set()
+        self.keys = np.zeros(0, dtype=np.uint32)
+        self.postings = np.zeros(0, dtype=np.int64)
+        self.merged = 0
+        self.snapshot_version = 0
+        self.verify_position = 0
+        self.refreshed_at = 0.0
+        self.saved_at = 0.0
+        self.lock = threading.Lock()
+
+    def _read(self, rel_path: str):
+        import numpy as np
+        full_path = os.path.join(self.root, rel_path)
+        try:
+            stats = file_cache.stat(full_path)
+            # Same limits as search_in_repo: larger files and binaries are never candidates
+            if stats[1] > SEARCH_MAX_FILE_BYTES:
+                return stats, np.zeros(0, dtype=np.uint32)
+            data = file_cache.read_bytes(full_path)
+        except OSError:
+            return None, None
+        if is_binary(data):
+            return stats, np.zeros(0, dtype=np.uint32)
+        return stats, file_trigrams(data)
+
+    def _remove(self, rel_path: str):
+        file_id = self.by_path.pop(rel_path)
+        self.files[file_id] = None
+        self.trigrams[file_id] = None
+        self.dead.add(file_id)
+
+    def _update_file(self, rel_path: str) -> bool:
+        """Re-read the file if it is new or its size or mtime changed, drop it if it is gone. Returns whether it changed."""
+        file_id = self.by_path.get(rel_path)
+        if file_id is not None:
+            try:
+                stats = file_cache.stat(os.path.join(self.root, rel_path))
+            except OSError:
+                self._remove(rel_path)
+                return True
+            if self.stats[file_id] == stats:
+                return False
+            self._remove(rel_path)
+        stats, trigrams = self._read(rel_path)
+        if stats is None:
+            return file_id is not None
+        self.by_path[rel_path] = len(self.files)
+        self.files.append(rel_path)
+        self.stats.append(stats)
+        self.trigrams.append(trigrams)
+        return True
+
+    def _maybe_merge(self):
+        if len(self.files) - self.merged > max(256, len(self.by_path) // 8) or len(self.dead) > len(self.by_path) // 8:
+            self._merge()
+
+    def update(self, paths: list) -> int:
+        """Bring the index in line with the given files, re-reading only changed ones. Returns the files re-read."""
+        changed = 0
+        current = set(paths)
+        for rel_path in [rel_path for rel_path in self.by_path if rel_path not in current]:
+            self._remove(rel_path)
+            changed += 1
+        for rel_path in paths:
+            changed += self._update_file(rel_path)
+        self._maybe_merge()
+        self.verify_position = 0
+        self.refreshed_at = time.monotonic()
+        return changed
+
+    def apply(self, added: set, removed: set, touched: set) -> int:
+        """Apply a snapshot's changes, re-checking only the files they name. Returns the files re-read or dropped."""
+        changed = 0
+        for rel_path in removed:
+            if rel_path in self.by_path:
+                self._remove(rel_path)
+                changed += 1
+        for rel_path in sorted(added | touched):
+            changed += self._update_file(rel_path)
+        self._maybe_merge()
+        return changed
+
+    def verify(self, paths: list) -> int:
+        """
+        Re-stat the files due since the last call, going round the repo, to catch files edited in place:
+        the share of the files that TRIGRAM_REFRESH_SECONDS has elapsed, so each is re-checked about that often.
+        """
+        now = time.monotonic()
+        share = 1.0 if TRIGRAM_REFRESH_SECONDS <= 0 else min(1.0, (now - self.refreshed_at) / TRIGRAM_REFRESH_SECONDS)
+        count = math.ceil(len(paths) * share)
+        if not count:
+            return 0
+        if self.verify_position >= len(paths):
+            self.verify_position = 0
+        batch = paths[self.verify_position:self.verify_position + count]
+        batch += paths[:count - len(batch)]
+        self.verify_position = (self.verify_position + count) % len(paths)
+        changed = sum(self._update_file(rel_path) for rel_path in batch)
+        self._maybe_merge()
+        self.refreshed_at = now
+        return changed
+
+    def _merge(self):
+        alive = [file_id for file_id, rel_path in enumerate(self.files) if rel_path is not None]
+        self.files = [self.files[file_id] for file_id in alive]
+        self.stats = [self.stats[file_id] for file_id in alive]
+        self.trigrams = [self.trigrams[file_id] for file_id in alive]
+        self.by_path = {rel_path: file_id for file_id, rel_path in enumerate(self.files)}
+        self.dead = set()
+        self._set_postings(self.trigrams)
+
+    def _set_postings(self, trigrams: list):
+        import numpy as np
+        lengths = np.fromiter((len(array) for array in trigrams), dtype=np.int64, count=len(trigrams))
+        keys = np.concatenate(trigrams) if trigrams else np.zeros(0, dtype=np.uint32)
+        file_ids = np.repeat(np.arange(len(trigrams), dtype=np.int64), lengths)
+        order = np.argsort(keys, kind="stable")
+        self.keys, self.postings = keys[order], file_ids[order]
+        self.merged = len(trigrams)
+
+    def _files_with_literal(self, literal: bytes):
+        import numpy as np
+        trigrams = file_trigrams(literal)
+        # Merged files: intersect posting lists, shortest first
+        # Same dtype as the keys, so the search does not convert the whole key array
+        ranges = list(zip(np.searchsorted(self.keys, trigrams, "left").tolist(),
+                          np.searchsorted(self.keys, trigrams, "right").tolist()))
+        ranges.sort(key=lambda bounds: bounds[1] - bounds[0])
+        found = None
+        for low, high in ranges:
+            posting = self.postings[low:high]
+            found = posting if found is None else np.intersect1d(found, posting, assume_unique=True)
+            if not len(found):
+                break
+        found = set(found.tolist()) if found is not None else set()
+        # Files added since the merge
+        for file_id in range(self.merged, len(self.files)):
+            if self.files[file_id] is not None and np.isin(trigrams, self.trigrams[file_id], assume_unique=True).all():
+                found.add(file_id)
+        return found - self.dead
+
+    def _evaluate(self, plan: list):
+        """File ids that can satisfy the plan, or None if it does not narrow the search."""
+        result = None
+        for term in plan:
+            if isinstance(term, tuple):
+                branches = [self._evaluate(branch) for branch in term[1]]
+                if any(branch is None for branch in branches):
+                    continue
+                found = set().union(*branches)
+            else:
+                found = self._files_with_literal(term)
+            result = found if result is None else result & found
+        return result
+
+    def candidates(self, pattern):
+        """Sorted relative paths of the files that may match the compiled bytes pattern, or None for all files."""
+        with self.lock:
+            file_ids = self._evaluate(query_plan(pattern))
+            if file_ids is None:
+                return None
+            return sorted(self.files[file_id] for file_id in file_ids)
+
+    def save(self):
+        import numpy as np
+        alive = [file_id for file_id, rel_path in enumerate(self.files) if rel_path is not None]
+        header = {
+            "version": TRIGRAM_INDEX_VERSION,
+            "root": self.root,
+            "files": [self.files[file_id] for file_id in alive],
+            "stats": [self.stats[file_id] for file_id in alive],
+        }
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wb") as f:
+            np.savez(
+                f,
+                header=np.frombuffer(json.dumps(header).encode("utf-8"), dtype=np.uint8),
+                lengths=np.array([len(self.trigrams[file_id]) for file_id in alive], dtype=np.int64),
+                trigrams=np.concatenate([self.trigrams[file_id] for file_id in alive]) if alive else np.zeros(0, dtype=np.uint32),
+            )
+        os.replace(temp_path, self.path)
+        self.saved_at = time.monotonic()
+
+    def load(self) -> bool:
+        import numpy as np
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with np.load(self.path) as data:
+                header = json.loads(data["header"].tobytes().decode("utf-8"))
+                if header.get("version") != TRIGRAM_INDEX_VERSION or header.get("root") != self.root:
+                    return False
+                offsets = np.concatenate([[0], np.cumsum(data["lengths"])])
+                trigrams = data["trigrams"]
+                self.trigrams = [trigrams[offsets[i]:offsets[i + 1]] for i in range(len(header["files"]))]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring unreadable trigram index {self.path}: {e}")
+            return False
+        self.files = header["files"]
+        self.stats = [tuple(stats) for stats in header["stats"]]
+        self.by_path = {rel_path: file_id for file_id, rel_path in enumerate(self.files)}
+        self.dead = set()
+        self._set_postings(self.trigrams)
+        return True
+
+    def refresh(self, snapshot, force: bool = False):
+        """
+        Apply the snapshot's changes since the last refresh (all files are re-statted on first use, when forced, or
+        when the snapshot no longer remembers them), then re-stat the files due for in-place edits.
+        Saves the index if files changed.
+        """
+        with self.lock:
+            with span("trigram_update"):
+                version, changes = snapshot.changes_since(self.snapshot_version)
+                if force or changes is None:
+                    changed = self.update(snapshot.list())
+                else:
+                    changed = self.apply(*changes) + self.verify(snapshot.list())
+                self.snapshot_version = version
+            if changed and (not self.saved_at or time.monotonic() - self.saved_at >= TRIGRAM_SAVE_SECONDS):
+                self.save()
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_trigram_index(repo_path: str, force_refresh: bool = False) -> TrigramIndex:
+    """The up to date trigram index of the repo, loaded from MCP_TRIGRAM_INDEX_DIR or built on first use."""
+    root = os.path.realpath(repo_path)
+    with _indexes_lock:
+        index = _indexes.get(root)
+        if index is None:
+            name = hashlib.sha1(root.encode("utf-8")).hexdigest()[:16]
+            index = _indexes[root] = TrigramIndex(root, os.path.join(TRIGRAM_INDEX_DIR, f"{name}.npz"))
+            index.load()
+    index.refresh(get_snapshot(root), force=force_refresh)
+    return index
@@ -0,0 +1,101 @@
+# --- app/usage.py ---
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+
+# USD per 1M tokens, as (prompt, completion). Models not listed (e.g. local embedding backends) cost nothing.
+MODEL_PRICES = {
+    "text-embedding-3-small": (0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.0),
+    "gpt-4": (30.0, 60.0),
+}
+
+# Every usage record is appended as a JSON line to MCP_USAGE_LOG (empty to disable),
+# rotated after MCP_USAGE_LOG_MAX_BYTES, keeping MCP_USAGE_LOG_BACKUPS old files
+USAGE_LOG = os.getenv("MCP_USAGE_LOG", "usage.jsonl")
+USAGE_LOG_MAX_BYTES = int(os.getenv("MCP_USAGE_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+USAGE_LOG_BACKUPS = int(os.getenv("MCP_USAGE_LOG_BACKUPS", "5"))
+
+# (repo_path, caller) the current request is billed to
+_attribution = ContextVar("usage_attribution", default=(None, None))
+_lock = threading.Lock()
+_totals = {}
+_by_repo = {}
+_by_caller = {}
+_logger = None
+
+
+def _empty_usage() -> dict:
+    return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "embedding_tokens": 0, "cost_usd": 0.0}
+
+
+def _get_logger():
+    global _logger
+    if _logger is None:
+        _logger = logging.getLogger("mcp.usage")
+        _logger.setLevel(logging.INFO)
+        _logger.propagate = False
+        if USAGE_LOG:
+            handler = RotatingFileHandler(USAGE_LOG, maxBytes=USAGE_LOG_MAX_BYTES, backupCount=USAGE_LOG_BACKUPS)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            _logger.addHandler(handler)
+    return _logger
+
+
+@contextmanager
+def attribute(repo_path: str, caller: str = None):
+    """Bill the usage recorded inside this block to repo_path and caller."""
+    token = _attribution.set((repo_path, caller or "anonymous"))
+    try:
+        yield
+    finally:
+        _attribution.reset(token)
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int = 0) -> float:
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+def record_usage(kind: str, model: str, prompt_tokens: int = 0, completion_tokens: int = 0):
+    """Record one API call; kind is "embedding" or "completion"."""
+    repo_path, caller = _attribution.get()
+    cost = estimate_cost(model, prompt_tokens, completion_tokens)
+    record = {
+        "timestamp": time.time(),
+        "kind": kind,
+        "model": model,
+        "repo_path": repo_path,
+        "caller": caller,
+        "prompt_tokens": prompt_tokens if kind != "embedding" else 0,
+        "completion_tokens": completion_tokens,
+        "embedding_tokens": prompt_tokens if kind == "embedding" else 0,
+        "cost_usd": cost,
+    }
+
+    with _lock:
+        for usage in (_totals, _by_repo.setdefault(repo_path, {}), _by_caller.setdefault(caller, {})):
+            if not usage:
+                usage.update(_empty_usage())
+            usage["calls"] += 1
+            for field in ("prompt_tokens", "completion_tokens", "embedding_tokens", "cost_usd"):
+                usage[field] += record[field]
+    _get_logger().info(json.dumps(record))
+
+
+def get_usage(repo_path: str = None, caller: str = None) -> dict:
+    with _lock:
+        if repo_path is not None:
+            return {"repo_path": repo_path, "usage": dict(_by_repo.get(repo_path) or _empty_usage())}
+        if caller is not None:
+            return {"caller": caller, "usage": dict(_by_caller.get(caller) or _empty_usage())}
+        return {
+            "totals": dict(_totals or _empty_usage()),
+            "by_repo": {str(repo): dict(usage) for repo, usage in _by_repo.items()},
+            "by_caller": {str(name): dict(usage) for name, usage in _by_caller.items()},
+        }
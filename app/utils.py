@@ -1,49 +1,282 @@
 # --- app/utils.py ---
+import hashlib
 import os
-import openai
-import numpy as np
+import threading
+import time
 from typing import List, Dict
+from app.metrics import span
+from app.usage import record_usage
+from app.scheduler import call_openai, estimate_tokens
+from app.hedging import LatencyTracker, hedged_call
+from app.embeddings import OpenAIEmbeddingBackend, HashingEmbeddingBackend, SentenceTransformerBackend
 
-openai.api_key = os.getenv("OPENAI_API_KEY")
-openai_client = openai.Client(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    max_retries=20,
-    )
+# Created on first use, so importing the server does not pay for importing openai
+openai_client = None
+
+def get_openai_client():
+    global openai_client
+    if openai_client is None:
+        import openai
+        openai_client = openai.Client(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            # Retries go through app.scheduler, so they respect the shared rate budgets
+            max_retries=0,
+            )
+    return openai_client
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# EMBEDDING_BACKEND selects how texts are embedded:
+#   "openai"  - OpenAI EMBEDDING_MODEL (default)
+#   "hashing" - deterministic local feature hashing, EMBEDDING_DIM dimensions, no network access
+#   "sentence-transformers" - local encoder on CPU loaded from EMBEDDING_MODEL_PATH,
+#                             using EMBEDDING_THREADS threads and EMBEDDING_MAX_BATCH_TOKENS padded tokens per batch
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")
+_embedding_backend = None
+
+def get_embedding_backend():
+    global _embedding_backend
+    if _embedding_backend is None:
+        if EMBEDDING_BACKEND == "openai":
+            _embedding_backend = OpenAIEmbeddingBackend(get_openai_client(), EMBEDDING_MODEL)
+        elif EMBEDDING_BACKEND == "hashing":
+            _embedding_backend = HashingEmbeddingBackend(dim=int(os.getenv("EMBEDDING_DIM", "1024")))
+        elif EMBEDDING_BACKEND == "sentence-transformers":
+            _embedding_backend = SentenceTransformerBackend(
+                os.environ["EMBEDDING_MODEL_PATH"],
+                num_threads=int(os.getenv("EMBEDDING_THREADS", "0")) or None,
+                max_batch_tokens=int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", "16384")),
+            )
+        else:
+            raise ValueError(f"Unknown EMBEDDING_BACKEND: {EMBEDDING_BACKEND}")
+    return _embedding_backend
+
+def get_embeddings(texts: List[str]) -> list:
+    return get_embedding_backend().embed_batch(texts)
 
 def get_embedding(text: str) -> list:
-    response = openai_client.embeddings.create(
-        input=text,
-        model="text-embedding-3-small",
-    )
-    return response.data[0].embedding
+    return get_embeddings([text])[0]
+
+# Tokenizer of the completion and embedding models. tiktoken downloads its encoding on first use, with no timeout,
+# so it is only loaded if already in tiktoken's cache (TIKTOKEN_CACHE_DIR, else its temp directory): without it,
+# counts fall back to an estimate. The server loads it at startup; other callers on first count.
+TOKEN_ENCODING_URL = "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken"
+_token_encoding = None
+_token_encoding_lock = threading.Lock()
+
+def _token_encoding_cached() -> bool:
+    """Whether tiktoken would find the encoding in its cache rather than download it."""
+    import tempfile
+    cache_dir = os.environ.get("TIKTOKEN_CACHE_DIR", os.environ.get("DATA_GYM_CACHE_DIR"))
+    if cache_dir is None:
+        cache_dir = os.path.join(tempfile.gettempdir(), "data-gym-cache")
+    if not cache_dir:
+        return False
+    return os.path.exists(os.path.join(cache_dir, hashlib.sha1(TOKEN_ENCODING_URL.encode()).hexdigest()))
+
+def load_token_encoding():
+    """The tiktoken encoding, or False if it is not cached or fails to load; loaded once."""
+    global _token_encoding
+    if _token_encoding is None:
+        with _token_encoding_lock:
+            if _token_encoding is None:
+                if not _token_encoding_cached():
+                    print("The tiktoken encoding is not cached, estimating token counts instead")
+                    _token_encoding = False
+                else:
+                    try:
+                        import tiktoken
+                        _token_encoding = tiktoken.get_encoding("cl100k_base")
+                    except Exception as e:
+                        print(f"Could not load the tiktoken encoding, estimating token counts instead: {e}")
+                        _token_encoding = False
+    return _token_encoding
+
+def count_tokens(text: str) -> int:
+    encoding = load_token_encoding()
+    if encoding is False:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def chunk_tokens(chunk: Dict) -> int:
+    """Token count of the chunk's content, computed once and kept on the chunk."""
+    if "tokens" not in chunk:
+        chunk["tokens"] = count_tokens(chunk["content"])
+    return chunk["tokens"]
 
 def cosine_similarity(a, b):
+    import numpy as np
     a, b = np.array(a), np.array(b)
     return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
 
 
-def get_top_k_chunks(query: str, chunks: List[Dict], k=5):
-    query_emb = get_embedding(query)
-    
-    # Compute similarity for each chunk and store it
-    similarities = []
-    for chunk in chunks:
-        sim = cosine_similarity(query_emb, chunk['embedding'])
-        similarities.append({
-            'content': chunk["content"],
-            'similarity': sim
-        })
-    
-    # Sort by similarity in descending order
-    ranked = sorted(similarities, key=lambda x: x['similarity'], reverse=True)
-    
-    # Return top-k results with similarity scores
-    return ranked[:k]
-    
-def call_openai_with_context(question, context_list, context_length=3000, input_file="app/input_rag.txt"):
-    def count_words(text):
-        return len(text.strip().split(" "))
+# Weight of redundancy vs relevance in MMR re-ranking (0 = pure relevance), and size of the candidate pool
+MMR_DIVERSITY = float(os.getenv("RAG_MMR_DIVERSITY", "0.3"))
+MMR_CANDIDATES = int(os.getenv("RAG_MMR_CANDIDATES", "25"))
+
+def get_embedding_matrix(chunks: List[Dict]) -> "np.ndarray":
+    """Stack chunk embeddings into a row-normalized matrix, so cosine similarity is a dot product."""
+    import numpy as np
+    if not chunks:
+        return np.zeros((0, 0), dtype=np.float32)
+    matrix = np.asarray([chunk["embedding"] for chunk in chunks], dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def count_words(text):
+    return len(text.strip().split(" "))
+
+def overlaps_kept_span(chunk: Dict, spans_by_file: Dict) -> bool:
+    """
+    Check whether the chunk's line span contains, or is contained in, a span already kept for its file,
+    recording the span as kept if not. Chunks without a span never overlap.
+    """
+    file_name = chunk.get("file")
+    if file_name is None or "start_line" not in chunk:
+        return False
+    start, end = chunk["start_line"], chunk["end_line"]
+    spans = spans_by_file.setdefault(file_name, [])
+    if any((s <= start and end <= e) or (start <= s and e <= end) for s, e in spans):
+        return True
+    spans.append((start, end))
+    return False
+
+def dedupe_contained_spans(candidates: List[int], chunks: List[Dict]) -> List[int]:
+    """
+    Drop candidates whose line span contains, or is contained in, the span of a better ranked
+    candidate from the same file (e.g. a method and its whole class). Candidates are best-first.
+    """
+    spans_by_file = {}
+    return [idx for idx in candidates if not overlaps_kept_span(chunks[idx], spans_by_file)]
+
+def chunk_result(chunk_id: int, chunk: Dict, similarity) -> Dict:
+    return {
+        'id': chunk_id,
+        'content': chunk["content"],
+        'similarity': similarity,
+        'file': chunk.get("file"),
+        'start_line': chunk.get("start_line"),
+        'end_line': chunk.get("end_line"),
+    }
+
+def mmr_rerank(query_vec: "np.ndarray", candidate_matrix: "np.ndarray", k: int, diversity: float) -> List[int]:
+    """
+    Maximal marginal relevance over the candidate rows: repeatedly pick the candidate maximizing
+    (1 - diversity) * relevance - diversity * (max similarity to the already selected ones).
+    Returns positions into candidate_matrix.
+    """
+    import numpy as np
+    relevance = candidate_matrix @ query_vec
+    redundancy = np.zeros(len(relevance), dtype=np.float32)
+    available = np.ones(len(relevance), dtype=bool)
+    selected = []
+    for _ in range(min(k, len(relevance))):
+        scores = (1 - diversity) * relevance - diversity * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, candidate_matrix @ candidate_matrix[best])
+    return selected
+
+def rank_by_similarity(query_vec: "np.ndarray", similarities: "np.ndarray", chunks: List[Dict], embedding_matrix,
+                       k: int, diversity: float, candidates: int) -> List[Dict]:
+    import numpy as np
+    # Take a larger pool than k, best-first, then de-duplicate overlapping spans and diversify it
+    pool_size = min(max(candidates, k), len(chunks))
+    pool = np.argpartition(-similarities, pool_size - 1)[:pool_size]
+    pool = pool[np.argsort(-similarities[pool])]
+    pool = dedupe_contained_spans(pool.tolist(), chunks)
+    order = mmr_rerank(query_vec, embedding_matrix[pool], k, diversity)
+
+    return [chunk_result(pool[position], chunks[pool[position]], float(similarities[pool[position]]))
+            for position in order]
+
+def normalize_queries(query_embs) -> "np.ndarray":
+    import numpy as np
+    query_matrix = np.atleast_2d(np.asarray(query_embs, dtype=np.float32))
+    norms = np.linalg.norm(query_matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return query_matrix / norms
+
+def rank_chunks(query_emb, chunks: List[Dict], k=5, embedding_matrix=None, diversity=None, candidates=None):
+    return rank_chunks_batch([query_emb], chunks, k, embedding_matrix, diversity, candidates)[0]
+
+def rank_chunks_batch(query_embs, chunks: List[Dict], k=5, embedding_matrix=None, diversity=None, candidates=None):
+    """Rank the chunks for many queries at once, scoring them all with a single matrix-matrix product."""
+    if not chunks or len(query_embs) == 0:
+        return [[] for _ in query_embs]
+    if embedding_matrix is None:
+        embedding_matrix = get_embedding_matrix(chunks)
+    diversity = MMR_DIVERSITY if diversity is None else diversity
+    candidates = MMR_CANDIDATES if candidates is None else candidates
+
+    query_matrix = normalize_queries(query_embs)
+    # (queries x chunks); each row is contiguous for the per-query argpartition below
+    similarities = query_matrix @ embedding_matrix.T
+    return [rank_by_similarity(query_vec, row, chunks, embedding_matrix, k, diversity, candidates)
+            for query_vec, row in zip(query_matrix, similarities)]
 
+def get_top_k_chunks(query: str, chunks: List[Dict], k=5, embedding_matrix=None, diversity=None, candidates=None):
+    with span("embed_query"):
+        query_emb = get_embedding(query)
+    with span("retrieve"):
+        return rank_chunks(query_emb, chunks, k=k, embedding_matrix=embedding_matrix,
+                           diversity=diversity, candidates=candidates)
+
+def get_top_k_chunks_batch(queries: List[str], chunks: List[Dict], k=5, embedding_matrix=None, diversity=None,
+                           candidates=None):
+    """get_top_k_chunks for many queries, embedded in one batch and scored in one matrix product."""
+    if not queries:
+        return []
+    with span("embed_query"):
+        query_embs = get_embeddings(queries)
+    with span("retrieve"):
+        return rank_chunks_batch(query_embs, chunks, k=k, embedding_matrix=embedding_matrix,
+                                 diversity=diversity, candidates=candidates)
+
+# How many hops of the cross-reference graph to follow, and how many words of referenced definitions to add
+XREF_HOPS = int(os.getenv("RAG_XREF_HOPS", "1"))
+XREF_BUDGET = int(os.getenv("RAG_XREF_BUDGET", "1000"))
+
+def expand_with_references(top_chunks: List[Dict], chunks: List[Dict], graph: Dict, budget=None, hops=None):
+    """
+    Append the chunks defining the names that the retrieved chunks import, call or inherit from
+    (e.g. the class behind an import line), breadth-first within a word budget.
+    """
+    budget = XREF_BUDGET if budget is None else budget
+    hops = XREF_HOPS if hops is None else hops
+    offsets, targets, kinds = graph["offsets"], graph["targets"], graph["kinds"]
+
+    expanded = list(top_chunks)
+    seen = {chunk["id"] for chunk in top_chunks}
+    spans_by_file = {}
+    for chunk in top_chunks:
+        overlaps_kept_span(chunk, spans_by_file)
+
+    used_words = 0
+    frontier = [chunk["id"] for chunk in top_chunks]
+    for _ in range(hops):
+        next_frontier = []
+        for chunk_id in frontier:
+            for position in range(offsets[chunk_id], offsets[chunk_id + 1]):
+                target = targets[position]
+                if target in seen:
+                    continue
+                seen.add(target)
+                words = count_words(chunks[target]["content"])
+                if used_words + words > budget or overlaps_kept_span(chunks[target], spans_by_file):
+                    continue
+                used_words += words
+                result = chunk_result(target, chunks[target], None)
+                result['reference'] = kinds[position]
+                expanded.append(result)
+                next_frontier.append(target)
+        frontier = next_frontier
+    return expanded
+
+def build_prompt(question, context_list, context_length=3000, input_file="app/input_rag.txt"):
     if input_file:
         with open(input_file, "r") as file:
             file_content = file.read()
@@ -92,6 +325,35 @@ def call_openai_with_context(question, context_list, context_length=3000, input_
     # Construct the final prompt
     context_str = "\n\n".join(selected_contexts)
     prompt = f""" You are a codebase assistant.  {file_content} Use the context below to answer the user question. [Context Start] {context_str} [Context End] Question: {question} Answer:"""
+    return prompt
+
+# Seconds a completion may take before the answer is given up on (0 = no deadline), overridable per request.
+# With LLM_HEDGE=1, a duplicate completion is fired once the first has been running for the observed p95 latency
+# (after LLM_HEDGE_MIN_SAMPLES completions), and whichever answers first is used.
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "120"))
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+llm_latency = LatencyTracker()
+
+def complete(prompt: str, timeout=None) -> str:
+    """Completion of the prompt; with a timeout, no attempt (first or retry) runs past timeout seconds from now."""
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    # The completion is budgeted as the prompt plus about as many tokens again for the answer
+    response = call_openai(get_openai_client().chat.completions.create, 2 * estimate_tokens(prompt), deadline=deadline,
+                           model="gpt-4", messages=[{"role": "user", "content": prompt}], temperature=0.2)
+    if response.usage is not None:
+        record_usage("completion", "gpt-4", response.usage.prompt_tokens, response.usage.completion_tokens)
+    return response.choices[0].message.content.strip()
 
-    response = openai_client.chat.completions.create(model="gpt-4", messages=[{"role": "user", "content": prompt}], temperature=0.2)
-    return response.choices[0].message.content.strip()
\ No newline at end of file
+def call_openai_with_context(question, context_list, context_length=3000, input_file="app/input_rag.txt",
+                             deadline=None, hedge=None):
+    """Raises TimeoutError if no completion arrives within the deadline (seconds, 0 for none)."""
+    deadline = LLM_DEADLINE_SECONDS if deadline is None else deadline
+    hedge = LLM_HEDGE if hedge is None else hedge
+    with span("pack"):
+        prompt = build_prompt(question, context_list, context_length, input_file)
+    with span("llm"):
+        hedge_after = llm_latency.percentile(LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_SAMPLES) if hedge else None
+        return hedged_call(lambda timeout: complete(prompt, timeout), deadline=deadline or None,
+                           hedge_after=hedge_after, tracker=llm_latency)
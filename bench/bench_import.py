@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark cold import time of the server and the evaluation script, each in a fresh interpreter,
+and report which heavy dependencies were loaded eagerly. Results are written as JSON.
+
+Usage:
+  python -m bench.bench_import --runs 5
+  python -m bench.bench_import --modules app.main server --output bench_import.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Dependencies that should only be imported when first used
+HEAVY_MODULES = ["openai", "numpy", "tqdm", "binaryornot", "nltk", "rouge_score", "textstat", "Levenshtein",
+                 "torch", "sentence_transformers", "tiktoken"]
+
+
+def get_git_commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_importtime(stderr: str):
+    """Parse `python -X importtime` output into {module: cumulative microseconds}."""
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, _, rest = line.partition(":")
+        _, cumulative_us, module = (part.strip() for part in rest.split("|"))
+        cumulative[module] = int(cumulative_us)
+    return cumulative
+
+
+def time_import(module: str) -> dict:
+    script = (
+        f"import sys, json; import {module}; "
+        f"print(json.dumps([name for name in {HEAVY_MODULES!r} if name in sys.modules]))"
+    )
+    env = dict(os.environ, OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "unused"))
+    start_time = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", script],
+                            cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+    wall_seconds = time.perf_counter() - start_time
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    cumulative = parse_importtime(result.stderr)
+    return {
+        "wall_seconds": wall_seconds,
+        "import_seconds": cumulative.get(module, 0) / 1e6,
+        "heavy_modules_loaded": json.loads(result.stdout.strip().splitlines()[-1]),
+        "slowest_imports": sorted(cumulative.items(), key=lambda item: item[1], reverse=True)[:10],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cold import time")
+    parser.add_argument("--modules", nargs="+", default=["app.main", "eval.evaluate"], help="Modules to import")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per module")
+    parser.add_argument("--output", default="bench_import.json", help="Path of the JSON results file")
+    args = parser.parse_args()
+
+    modules = {}
+    for module in args.modules:
+        runs = [time_import(module) for _ in range(args.runs)]
+        import_seconds = [run["import_seconds"] for run in runs]
+        modules[module] = {
+            "import_seconds_median": statistics.median(import_seconds),
+            "import_seconds_min": min(import_seconds),
+            "wall_seconds_median": statistics.median(run["wall_seconds"] for run in runs),
+            "heavy_modules_loaded": runs[-1]["heavy_modules_loaded"],
+            "slowest_imports_us": runs[-1]["slowest_imports"],
+        }
+        print(f"{module}: {modules[module]['import_seconds_median'] * 1000:.0f} ms median import, "
+              f"heavy modules loaded: {', '.join(modules[module]['heavy_modules_loaded']) or 'none'}")
+
+    results = {
+        "timestamp": datetime.now().isoformat(),
+        "git_commit": get_git_commit(),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "modules": modules,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Benchmark the index builder on a synthetic repository, with embeddings served by the fake
+embedding server (or the local hashing backend), and write the results as JSON.
+
+Usage:
+  python -m bench.bench_index_build --files 10000 --latency-ms 50 --rpm 3000 --output bench_index.json
+  python -m bench.bench_index_build --repo-path ./grip-repo --backend hashing
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime
+from bench.synthetic_repo import generate_repo
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def get_git_commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# The fake server runs in its own process, so its CPU time is not counted against the index builder
+def start_fake_server(latency_ms: float, rpm: int, dim: int):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, "-m", "bench.fake_embedding_server", "--port", str(port),
+         "--latency-ms", str(latency_ms), "--rpm", str(rpm), "--dim", str(dim)],
+        cwd=REPO_ROOT, stdout=subprocess.PIPE, text=True,
+    )
+    process.stdout.readline()  # wait for the startup line
+    return process, f"http://127.0.0.1:{port}"
+
+
+def get_fake_server_stats(server_url: str) -> dict:
+    with urllib.request.urlopen(f"{server_url}/stats") as response:
+        return json.loads(response.read())
+
+
+def run_stages(repo_path: str) -> dict:
+    # Imported here, after the embedding backend has been configured through the environment
+    from app.index_builder import iter_repo_files, read_source, extract_chunks, embed_chunks
+
+    stages = {}
+    start_time = time.perf_counter()
+    files = list(iter_repo_files(repo_path))
+    stages["walk"] = {"seconds": time.perf_counter() - start_time, "files": len(files)}
+
+    start_time = time.perf_counter()
+    chunks, errors = [], 0
+    for full_path in files:
+        try:
+            source = read_source(full_path)
+            if source is None:
+                continue
+            chunks.extend(extract_chunks(full_path, repo_path, source))
+        except Exception:
+            errors += 1
+    stages["parse"] = {"seconds": time.perf_counter() - start_time, "chunks": len(chunks), "errors": errors}
+
+    start_time = time.perf_counter()
+    embedded = embed_chunks(chunks)
+    stages["embed"] = {"seconds": time.perf_counter() - start_time, "chunks": len(embedded)}
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark index building")
+    parser.add_argument("--repo-path", help="Index this repository instead of generating a synthetic one")
+    parser.add_argument("--files", type=int, default=1000, help="Number of files in the synthetic repository")
+    parser.add_argument("--python-ratio", type=float, default=0.8, help="Fraction of synthetic files that are Python")
+    parser.add_argument("--backend", choices=["fake-server", "hashing"], default="fake-server",
+                        help="Embed through the fake OpenAI server, or with the local hashing backend")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Fake server latency per embedding call")
+    parser.add_argument("--rpm", type=int, default=0, help="Fake server requests-per-minute limit (0 = unlimited)")
+    parser.add_argument("--dim", type=int, default=256, help="Embedding dimension")
+    parser.add_argument("--output", default="bench_index_build.json", help="Path of the JSON results file")
+    args = parser.parse_args()
+
+    server, server_url = None, None
+    if args.backend == "fake-server":
+        server, server_url = start_fake_server(args.latency_ms, args.rpm, args.dim)
+        os.environ["EMBEDDING_BACKEND"] = "openai"
+        os.environ["OPENAI_BASE_URL"] = f"{server_url}/v1"
+        os.environ.setdefault("OPENAI_API_KEY", "fake-key")
+    else:
+        os.environ["EMBEDDING_BACKEND"] = "hashing"
+        os.environ["EMBEDDING_DIM"] = str(args.dim)
+        os.environ.setdefault("OPENAI_API_KEY", "unused")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        repo_path = args.repo_path
+        generate_seconds = None
+        if not repo_path:
+            repo_path = tmp_dir
+            start_time = time.perf_counter()
+            generate_repo(repo_path, args.files, args.python_ratio)
+            generate_seconds = time.perf_counter() - start_time
+
+        stages = run_stages(repo_path)
+        total_seconds = sum(stage["seconds"] for stage in stages.values())
+
+    server_stats = {}
+    if server:
+        server_stats = get_fake_server_stats(server_url)
+        server.terminate()
+
+    num_files = stages["walk"]["files"]
+    num_chunks = stages["embed"]["chunks"]
+    results = {
+        "timestamp": datetime.now().isoformat(),
+        "git_commit": get_git_commit(),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "generate_seconds": generate_seconds,
+        "stages": stages,
+        "total_seconds": total_seconds,
+        "files_per_second": num_files / total_seconds if total_seconds else 0,
+        "chunks_per_second": num_chunks / total_seconds if total_seconds else 0,
+        "embedding_calls": server_stats.get("requests"),
+        "rate_limited_calls": server_stats.get("rate_limited"),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"\nResults saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
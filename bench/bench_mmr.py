@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Measure the latency overhead of MMR re-ranking and span de-duplication in retrieval.
+Uses a synthetic index of random embeddings with overlapping line spans, so no API calls are made.
+
+Usage:
+  python -m bench.bench_mmr --chunks 10000 --dim 1536 --queries 200
+"""
+
+import argparse
+import json
+import statistics
+import time
+import numpy as np
+from app.utils import get_embedding_matrix, rank_chunks
+
+
+def make_synthetic_chunks(num_chunks: int, dim: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    embeddings = rng.standard_normal((num_chunks, dim)).astype(np.float32)
+    chunks = []
+    for i in range(num_chunks):
+        # Every 5 chunks share a file: one "class" spanning lines 1-100 and four "methods" inside it
+        start_line = 1 if i % 5 == 0 else (i % 5) * 20
+        end_line = 100 if i % 5 == 0 else start_line + 15
+        chunks.append({
+            "content": f"chunk {i}",
+            "embedding": embeddings[i],
+            "file": f"pkg/module_{i // 5}.py",
+            "start_line": start_line,
+            "end_line": end_line,
+        })
+    return chunks
+
+
+def time_queries(queries, chunks, matrix, k, diversity, candidates):
+    latencies = []
+    for query_emb in queries:
+        start_time = time.perf_counter()
+        rank_chunks(query_emb, chunks, k=k, embedding_matrix=matrix, diversity=diversity, candidates=candidates)
+        latencies.append((time.perf_counter() - start_time) * 1000)
+    latencies.sort()
+    return {
+        "mean_ms": statistics.mean(latencies),
+        "p50_ms": latencies[len(latencies) // 2],
+        "p95_ms": latencies[int(0.95 * (len(latencies) - 1))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MMR re-ranking overhead")
+    parser.add_argument("--chunks", type=int, default=10000, help="Number of chunks in the synthetic index")
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimension")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries to time")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--candidates", type=int, default=25, help="Size of the MMR candidate pool")
+    parser.add_argument("--diversity", type=float, default=0.3, help="MMR diversity weight")
+    args = parser.parse_args()
+
+    chunks = make_synthetic_chunks(args.chunks, args.dim)
+    matrix = get_embedding_matrix(chunks)
+    queries = np.random.default_rng(1).standard_normal((args.queries, args.dim)).astype(np.float32)
+
+    # Baseline: plain top-k, i.e. a pool of exactly k and no diversity
+    baseline = time_queries(queries, chunks, matrix, args.k, 0.0, args.k)
+    mmr = time_queries(queries, chunks, matrix, args.k, args.diversity, args.candidates)
+    results = {
+        "chunks": args.chunks,
+        "dim": args.dim,
+        "queries": args.queries,
+        "baseline": baseline,
+        "mmr": mmr,
+        "overhead_ms": mmr["mean_ms"] - baseline["mean_ms"],
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
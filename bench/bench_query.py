@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Benchmark the query path: query embedding, retrieval, cross-reference expansion and prompt building,
+on synthetic indexes, and the overhead of sending the completion, with the chat completion stubbed out.
+Reports p50/p95/p99 latency per stage, peak bytes allocated per query, and latency under concurrent load,
+and writes the results as JSON.
+
+Usage:
+  python -m bench.bench_query --chunks 10000 100000 --queries 200 --concurrency 1 8
+  python -m bench.bench_query --chunks 1000000 --dim 128 --output bench_query.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from types import SimpleNamespace
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORDS = ["reader", "renderer", "server", "cache", "asset", "request", "response", "config", "user",
+         "session", "token", "index", "path", "style", "theme", "export", "browser", "client", "handler"]
+QUESTIONS = [
+    "What does class {} do?",
+    "How is parameter {} used?",
+    "Where is the {} handler defined?",
+    "Which function reads the {} config?",
+]
+
+
+class StubChatClient:
+    """Stands in for the OpenAI client, answering every chat completion instantly."""
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        message = SimpleNamespace(content="stub answer")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+def get_git_commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_synthetic_index(num_chunks: int, dim: int, seed: int = 0):
+    """
+    Chunks with short code-like contents and nested line spans, a random cross-reference graph,
+    and a random normalized embedding matrix (chunks carry no embedding lists, to keep memory flat at 1M chunks).
+    """
+    rng = np.random.default_rng(seed)
+    matrix = rng.standard_normal((num_chunks, dim), dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+
+    chunks = []
+    for i in range(num_chunks):
+        words = " ".join(WORDS[(i * 7 + j) % len(WORDS)] for j in range(40))
+        start_line = 1 if i % 5 == 0 else (i % 5) * 20
+        chunks.append({
+            "content": f"In file pkg/module_{i // 5}.py, the content is def {WORDS[i % len(WORDS)]}_{i}(self): {words}",
+            "file": f"pkg/module_{i // 5}.py",
+            "start_line": start_line,
+            "end_line": 100 if i % 5 == 0 else start_line + 15,
+        })
+
+    degrees = rng.integers(0, 4, size=num_chunks)
+    offsets = [0] + np.cumsum(degrees).tolist()
+    targets = rng.integers(0, num_chunks, size=int(degrees.sum())).tolist()
+    graph = {"offsets": offsets, "targets": targets, "kinds": ["call"] * len(targets)}
+    return chunks, matrix, graph
+
+
+def percentiles(latencies_ms):
+    latencies_ms = sorted(latencies_ms)
+    def pick(q):
+        return latencies_ms[min(len(latencies_ms) - 1, int(q * len(latencies_ms)))]
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "mean_ms": float(np.mean(latencies_ms))}
+
+
+def run_query(question, chunks, matrix, graph):
+    """One query through the pipeline, returning the wall-clock time of each stage in milliseconds."""
+    from app import utils
+
+    timings = {}
+    start_time = time.perf_counter()
+    query_emb = utils.get_embedding(question)
+    timings["embed_query"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    top_chunks = utils.rank_chunks(query_emb, chunks, k=5, embedding_matrix=matrix)
+    timings["retrieve"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    top_chunks = utils.expand_with_references(top_chunks, chunks, graph)
+    timings["expand"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    context_list = [chunk["content"] for chunk in top_chunks]
+    prompt = utils.build_prompt(question, context_list)
+    timings["build_prompt"] = time.perf_counter() - start_time
+
+    # The stubbed completion as call_openai_with_context makes it: scheduler budgets and the hedged_call thread hop
+    start_time = time.perf_counter()
+    utils.hedged_call(lambda timeout: utils.complete(prompt, timeout), deadline=utils.LLM_DEADLINE_SECONDS or None)
+    timings["llm_stub"] = time.perf_counter() - start_time
+
+    timings["total"] = sum(timings.values())
+    return {stage: seconds * 1000 for stage, seconds in timings.items()}
+
+
+def bench_latency(questions, chunks, matrix, graph, concurrency: int) -> dict:
+    start_time = time.perf_counter()
+    if concurrency == 1:
+        runs = [run_query(question, chunks, matrix, graph) for question in questions]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            runs = list(executor.map(lambda question: run_query(question, chunks, matrix, graph), questions))
+    wall_seconds = time.perf_counter() - start_time
+
+    return {
+        "concurrency": concurrency,
+        "queries_per_second": len(questions) / wall_seconds,
+        "stages": {stage: percentiles([run[stage] for run in runs]) for stage in runs[0]},
+    }
+
+
+def bench_allocations(questions, chunks, matrix, graph) -> dict:
+    """Peak bytes traced by tracemalloc during each query, above what was allocated before it."""
+    peaks = []
+    tracemalloc.start()
+    for question in questions:
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        run_query(question, chunks, matrix, graph)
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - baseline)
+    tracemalloc.stop()
+    return {"mean_peak_bytes": float(np.mean(peaks)), "max_peak_bytes": int(max(peaks))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the query path with the LLM stubbed out")
+    parser.add_argument("--chunks", type=int, nargs="+", default=[10000, 100000], help="Index sizes to benchmark")
+    parser.add_argument("--dim", type=int, default=256, help="Embedding dimension")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries per run")
+    parser.add_argument("--alloc-queries", type=int, default=20, help="Number of queries traced for allocations")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8], help="Concurrent query levels")
+    parser.add_argument("--output", default="bench_query.json", help="Path of the JSON results file")
+    args = parser.parse_args()
+
+    # Local query embeddings matching the synthetic index dimension, and no real chat completions
+    os.environ["EMBEDDING_BACKEND"] = "hashing"
+    os.environ["EMBEDDING_DIM"] = str(args.dim)
+    os.environ.setdefault("OPENAI_API_KEY", "unused")
+    # The prompt template path is relative to the repo root
+    output_path = os.path.abspath(args.output)
+    os.chdir(REPO_ROOT)
+    from app import utils
+    utils.openai_client = StubChatClient()
+
+    questions = [QUESTIONS[i % len(QUESTIONS)].format(WORDS[i % len(WORDS)]) for i in range(args.queries)]
+    runs = []
+    for num_chunks in args.chunks:
+        print(f"Building synthetic index of {num_chunks} chunks...")
+        chunks, matrix, graph = make_synthetic_index(num_chunks, args.dim)
+        run_query(questions[0], chunks, matrix, graph)  # warm up
+        run = {
+            "chunks": num_chunks,
+            "latency": [bench_latency(questions, chunks, matrix, graph, level) for level in args.concurrency],
+            "allocations": bench_allocations(questions[:args.alloc_queries], chunks, matrix, graph),
+        }
+        runs.append(run)
+        single = run["latency"][0]["stages"]["total"]
+        print(f"  total p50 {single['p50_ms']:.2f} ms, p99 {single['p99_ms']:.2f} ms")
+        del chunks, matrix, graph
+
+    results = {
+        "timestamp": datetime.now().isoformat(),
+        "git_commit": get_git_commit(),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "runs": runs,
+    }
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to: {output_path}")
+
+
+if __name__ == "__main__":
+    main()
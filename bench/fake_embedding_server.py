@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI embeddings endpoint, for benchmarking the index builder without network access.
+Point the OpenAI client at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+Responses are deterministic hashing embeddings, served after a configurable latency,
+and requests over the configured rate limit get a 429 like the real API.
+GET /stats returns the request counters.
+
+Usage:
+  python -m bench.fake_embedding_server --port 8765 --latency-ms 50 --rpm 3000
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from app.embeddings import HashingEmbeddingBackend
+
+
+class FakeEmbeddingServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency_ms: float = 0, rpm: int = 0, dim: int = 256):
+        super().__init__(address, FakeEmbeddingHandler)
+        self.latency = latency_ms / 1000
+        self.rpm = rpm
+        self.backend = HashingEmbeddingBackend(dim=dim)
+        self.lock = threading.Lock()
+        self.window_start = time.monotonic()
+        self.window_requests = 0
+        self.stats = {"requests": 0, "rate_limited": 0, "inputs": 0}
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def allow_request(self) -> bool:
+        with self.lock:
+            self.stats["requests"] += 1
+            if not self.rpm:
+                return True
+            now = time.monotonic()
+            if now - self.window_start >= 60:
+                self.window_start, self.window_requests = now, 0
+            if self.window_requests >= self.rpm:
+                self.stats["rate_limited"] += 1
+                return False
+            self.window_requests += 1
+            return True
+
+
+class FakeEmbeddingHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/stats":
+            return self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+        with self.server.lock:
+            self.send_json(200, dict(self.server.stats))
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/embeddings"):
+            return self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        if not self.server.allow_request():
+            return self.send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}},
+                                  {"retry-after-ms": "500"})
+
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        time.sleep(self.server.latency)
+        embeddings = self.server.backend.embed_batch(texts)
+        with self.server.lock:
+            self.server.stats["inputs"] += len(texts)
+        num_tokens = sum(len(text) // 4 for text in texts)
+        self.send_json(200, {
+            "object": "list",
+            "model": body.get("model"),
+            "data": [{"object": "embedding", "index": i, "embedding": embedding} for i, embedding in enumerate(embeddings)],
+            "usage": {"prompt_tokens": num_tokens, "total_tokens": num_tokens},
+        })
+
+    def send_json(self, status: int, payload: dict, headers: dict = None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake OpenAI embeddings server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Delay before each response")
+    parser.add_argument("--rpm", type=int, default=0, help="Requests per minute before returning 429 (0 = unlimited)")
+    parser.add_argument("--dim", type=int, default=256, help="Embedding dimension")
+    args = parser.parse_args()
+
+    server = FakeEmbeddingServer((args.host, args.port), args.latency_ms, args.rpm, args.dim)
+    print(f"Fake embedding server on {server.base_url}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
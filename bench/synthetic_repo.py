@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Generate a synthetic repository of Python modules and Markdown docs for benchmarks.
+The output is deterministic for a given seed, so runs on different versions index the same tree.
+
+Usage:
+  python -m bench.synthetic_repo /tmp/synthetic-repo --files 10000
+"""
+
+import argparse
+import os
+import random
+
+WORDS = [
+    "reader", "renderer", "server", "cache", "asset", "request", "response", "config", "user",
+    "session", "token", "index", "path", "style", "theme", "export", "browser", "client", "handler",
+]
+
+
+def make_python_module(rng: random.Random, module_id: int) -> str:
+    lines = ['"""Synthetic module {}."""'.format(module_id), "import os"]
+    if module_id > 0:
+        other = rng.randrange(module_id)
+        lines.append(f"from .module_{other} import Class{other}_0")
+    lines.append("")
+    for class_id in range(rng.randint(1, 3)):
+        noun = rng.choice(WORDS).capitalize()
+        lines.append(f"class Class{module_id}_{class_id}(object):")
+        lines.append(f'    """A {noun.lower()} used by module {module_id}."""')
+        for method_id in range(rng.randint(1, 5)):
+            verb = rng.choice(WORDS)
+            lines.append(f"    def {verb}_{method_id}(self, value=None):")
+            lines.append(f'        """Return the {verb} for value."""')
+            lines.append(f"        path = os.path.join('{verb}', str(value))")
+            lines.append(f"        return self.{rng.choice(WORDS)}_lookup(path) if value else None")
+            lines.append("")
+    for function_id in range(rng.randint(0, 3)):
+        verb = rng.choice(WORDS)
+        lines.append(f"def {verb}_helper_{function_id}(items):")
+        lines.append(f"    return [item for item in items if '{verb}' in item]")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def make_markdown_doc(rng: random.Random) -> str:
+    title = " ".join(rng.choice(WORDS) for _ in range(3)).title()
+    paragraphs = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 80))) for _ in range(rng.randint(1, 5))]
+    return f"# {title}\n\n" + "\n\n".join(paragraphs) + "\n"
+
+
+def generate_repo(output_dir: str, num_files: int, python_ratio: float = 0.8, files_per_dir: int = 100, seed: int = 0):
+    """Write num_files files under output_dir, spread over packages of files_per_dir files each."""
+    rng = random.Random(seed)
+    num_python = int(num_files * python_ratio)
+    for file_id in range(num_files):
+        package_dir = os.path.join(output_dir, f"package_{file_id // files_per_dir}")
+        os.makedirs(package_dir, exist_ok=True)
+        if file_id < num_python:
+            file_path = os.path.join(package_dir, f"module_{file_id % files_per_dir}.py")
+            content = make_python_module(rng, file_id % files_per_dir)
+        else:
+            file_path = os.path.join(package_dir, f"doc_{file_id}.md")
+            content = make_markdown_doc(rng)
+        with open(file_path, "w", encoding="utf-8") as f:
+            f.write(content)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic repository")
+    parser.add_argument("output_dir", help="Directory to write the repository into")
+    parser.add_argument("--files", type=int, default=1000, help="Number of files to generate")
+    parser.add_argument("--python-ratio", type=float, default=0.8, help="Fraction of files that are Python")
+    parser.add_argument("--files-per-dir", type=int, default=100, help="Number of files per package directory")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate_repo(args.output_dir, args.files, args.python_ratio, args.files_per_dir, args.seed)
+    print(f"Generated {args.files} files in {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,8 +7,6 @@ Processes folders containing numbered .q.md and .a.md files and generates detail
 import asyncio
 import os
 import re
-from fastmcp import Client
-import requests
 import json
 import argparse
 from pathlib import Path
@@ -18,31 +16,35 @@ import statistics
 from datetime import datetime
 import difflib
 from collections import Counter
-import nltk
-from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
-from nltk.tokenize import word_tokenize, sent_tokenize
-from nltk.corpus import stopwords
-from rouge_score import rouge_scorer
-import textstat
-import Levenshtein
-import openai
+
+# Heavy dependencies (nltk, rouge_score, textstat, Levenshtein, openai, fastmcp) are imported
+# where they are first used, so importing this module stays cheap.
 
 # from app.main import mcp
-openai_client = openai.Client(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    max_retries=20,
-    )
+openai_client = None
 
-# Download required NLTK data
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt')
+def get_openai_client():
+    global openai_client
+    if openai_client is None:
+        import openai
+        openai_client = openai.Client(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            max_retries=20,
+            )
+    return openai_client
 
-try:
-    nltk.data.find('corpora/stopwords')
-except LookupError:
-    nltk.download('stopwords')
+def ensure_nltk_data():
+    """Download required NLTK data"""
+    import nltk
+    try:
+        nltk.data.find('tokenizers/punkt')
+    except LookupError:
+        nltk.download('punkt')
+
+    try:
+        nltk.data.find('corpora/stopwords')
+    except LookupError:
+        nltk.download('stopwords')
 
 class QAEvaluator:
     def __init__(self, api_url: str = "http://localhost:8080/mcp", repo_path: str = ""):
@@ -50,6 +52,9 @@ class QAEvaluator:
         self.repo_path = repo_path
         self.results = []
         self.response_times = []
+        from nltk.corpus import stopwords
+        from rouge_score import rouge_scorer
+        ensure_nltk_data()
         self.rouge_scorer = rouge_scorer.RougeScorer(['rouge1', 'rouge2', 'rougeL'], use_stemmer=True)
         self.stop_words = set(stopwords.words('english'))
         # self.client = asyncio.run(self.client)
@@ -92,6 +97,8 @@ class QAEvaluator:
     
     async def query_api(self, question: str) -> Tuple[Optional[str], float, int]:
         """Query API and return prediction, response time."""
+        import requests
+        from fastmcp import Client
         try:
             payload = {"request": {"repo_path": self.repo_path, "question": question}}
             start_time = time.time()
@@ -115,6 +122,8 @@ class QAEvaluator:
         """Calculate BLEU score between reference and hypothesis."""
         if not reference or not hypothesis:
             return 0.0
+        from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
+        from nltk.tokenize import word_tokenize
         
         ref_tokens = word_tokenize(reference.lower())
         hyp_tokens = word_tokenize(hypothesis.lower())
@@ -138,6 +147,7 @@ class QAEvaluator:
         """Calculate semantic similarity using word overlap."""
         if not reference or not hypothesis:
             return 0.0
+        from nltk.tokenize import word_tokenize
         
         ref_words = set(word_tokenize(reference.lower())) - self.stop_words
         hyp_words = set(word_tokenize(hypothesis.lower())) - self.stop_words
@@ -159,6 +169,7 @@ class QAEvaluator:
         if not reference or not hypothesis:
             return 0.0
         
+        import Levenshtein
         distance = Levenshtein.distance(reference, hypothesis)
         max_len = max(len(reference), len(hypothesis))
         return 1 - (distance / max_len) if max_len > 0 else 1.0
@@ -182,6 +193,7 @@ class QAEvaluator:
         """Calculate readability metrics for the generated text."""
         if not text:
             return {'flesch_reading_ease': 0, 'flesch_kincaid_grade': 0, 'gunning_fog': 0}
+        import textstat
         
         return {
             'flesch_reading_ease': textstat.flesch_reading_ease(text),
@@ -193,6 +205,7 @@ class QAEvaluator:
         """Analyze how well the hypothesis covers the reference content."""
         if not reference or not hypothesis:
             return {'concept_coverage': 0.0, 'key_phrase_coverage': 0.0}
+        from nltk.tokenize import word_tokenize
         
         # Extract key phrases (sequences of 2-3 words)
         ref_words = word_tokenize(reference.lower())
@@ -231,7 +244,7 @@ class QAEvaluator:
         """
         try:
 
-            response = openai_client.chat.completions.create(
+            response = get_openai_client().chat.completions.create(
             model="gpt-4",
             messages=[{"role": "user", "content": prompt}],
             temperature=0,
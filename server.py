@@ -1,7 +1,21 @@
+import os
 from app.main import mcp
+from app.rag_pipeline import load_prebuilt_index
+from app.utils import load_token_encoding
+
+
+# MCP_PREBUILT_INDEXES lists index files built with `python -m app.build_index build`,
+# separated by os.pathsep. Each entry may be "index_file" or "index_file=repo_path".
+def load_prebuilt_indexes():
+    for entry in filter(None, os.getenv("MCP_PREBUILT_INDEXES", "").split(os.pathsep)):
+        index_path, _, repo_path = entry.partition("=")
+        load_prebuilt_index(index_path, repo_path or None)
 
 
 if __name__ == "__main__":
+    load_prebuilt_indexes()
+    # Before serving, so no tool call waits for the tokenizer
+    load_token_encoding()
     print("Starting MCP Server on http://localhost:8080")
     mcp.run(transport="http", host="0.0.0.0", port=8080)
 
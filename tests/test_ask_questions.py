@@ -0,0 +1,23 @@
+import asyncio
+
+import numpy as np
+from fastmcp import Client
+
+import app.main as main
+from app.utils import rank_chunks_batch
+
+
+def test_rank_chunks_batch_without_queries():
+    chunks = [{"content": "def f(): pass"}]
+    embedding_matrix = np.ones((1, 4), dtype=np.float32)
+    assert rank_chunks_batch([], chunks, embedding_matrix=embedding_matrix) == []
+    assert rank_chunks_batch(np.zeros((0, 4), dtype=np.float32), chunks, embedding_matrix=embedding_matrix) == []
+
+
+def test_ask_questions_without_questions(tmp_path):
+    async def ask():
+        async with Client(main.mcp) as client:
+            return await client.call_tool("ask_questions", {"request": {"repo_path": str(tmp_path), "questions": []}})
+
+    result = asyncio.run(ask())
+    assert result.data == {"results": []}
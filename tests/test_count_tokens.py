@@ -0,0 +1,31 @@
+import hashlib
+
+import tiktoken
+
+import app.utils as utils
+
+
+def test_uncached_encoding_is_not_downloaded(tmp_path, monkeypatch):
+    monkeypatch.setenv("TIKTOKEN_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(utils, "_token_encoding", None)
+
+    def download(*args, **kwargs):
+        raise AssertionError("the encoding must not be downloaded")
+
+    monkeypatch.setattr(tiktoken, "get_encoding", download)
+    monkeypatch.setattr(tiktoken, "encoding_for_model", download)
+    assert utils.count_tokens("def f(): pass") == utils.estimate_tokens("def f(): pass")
+    assert utils.load_token_encoding() is False
+
+
+def test_cached_encoding_is_loaded(tmp_path, monkeypatch):
+    monkeypatch.setenv("TIKTOKEN_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(utils, "_token_encoding", None)
+    (tmp_path / hashlib.sha1(utils.TOKEN_ENCODING_URL.encode()).hexdigest()).write_bytes(b"")
+
+    class Encoding:
+        def encode(self, text, disallowed_special=()):
+            return text.split()
+
+    monkeypatch.setattr(tiktoken, "get_encoding", lambda name: Encoding())
+    assert utils.count_tokens("def f(): pass") == 3
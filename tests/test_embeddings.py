@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from app.embeddings import SentenceTransformerBackend
+
+WORDS = ["def", "class", "return", "import", "self", "config", "reader", "server", "cache", "path", "token", "index"]
+
+
+def save_tiny_model(path, seed: int = 0):
+    """A 16-dimensional randomly initialised BERT with mean pooling, saved as a sentence-transformers model."""
+    import torch
+    from sentence_transformers import SentenceTransformer, models
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    torch.manual_seed(seed)
+    transformer_path = path / "transformer"
+    transformer_path.mkdir(parents=True)
+    vocab_file = transformer_path / "vocab.txt"
+    vocab_file.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + WORDS) + "\n")
+    BertTokenizerFast(vocab_file=str(vocab_file)).save_pretrained(transformer_path)
+    config = BertConfig(vocab_size=len(WORDS) + 5, hidden_size=16, num_hidden_layers=1, num_attention_heads=2,
+                        intermediate_size=32, max_position_embeddings=64)
+    BertModel(config).save_pretrained(transformer_path)
+
+    transformer = models.Transformer(str(transformer_path), max_seq_length=64)
+    pooling = models.Pooling(config.hidden_size, pooling_mode="mean")
+    SentenceTransformer(modules=[transformer, pooling], device="cpu").save(str(path / "model"))
+    return str(path / "model")
+
+
+@pytest.fixture(scope="module")
+def model_path(tmp_path_factory):
+    return save_tiny_model(tmp_path_factory.mktemp("tiny-bert"))
+
+
+def test_batches_stay_under_the_token_budget(model_path):
+    backend = SentenceTransformerBackend(model_path, max_batch_tokens=40, max_batch_size=3)
+    lengths = [12, 3, 7, 20, 5, 5, 9, 2, 30, 4]
+    batches = backend._make_batches(lengths)
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+    for batch in batches:
+        assert len(batch) <= 3
+        # A text longer than the budget still gets a batch of its own
+        assert len(batch) * max(lengths[i] for i in batch) <= 40 or len(batch) == 1
+
+
+def test_embeddings_keep_the_input_order(model_path):
+    import torch
+    threads = torch.get_num_threads()
+    try:
+        backend = SentenceTransformerBackend(model_path, num_threads=1, max_batch_tokens=24, max_batch_size=4)
+        assert torch.get_num_threads() == 1
+    finally:
+        torch.set_num_threads(threads)
+    rng = np.random.default_rng(0)
+    texts = [" ".join(rng.choice(WORDS, size=length)) for length in [1, 9, 3, 15, 2, 6, 11, 4, 1, 7]]
+    embeddings = np.array(backend.embed_batch(texts))
+    expected = backend.model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+    assert embeddings.shape == (len(texts), 16)
+    np.testing.assert_allclose(embeddings, expected, atol=1e-5)
+    assert backend.embed_batch([]) == []
+
+
+def test_name_tells_models_in_same_named_directories_apart(tmp_path, model_path):
+    other_path = save_tiny_model(tmp_path, seed=1)
+    name, other_name = SentenceTransformerBackend(model_path).name, SentenceTransformerBackend(other_path).name
+    assert name.startswith("sentence-transformers/model@")
+    assert other_name.startswith("sentence-transformers/model@")
+    assert name != other_name
+    assert SentenceTransformerBackend(model_path).name == name
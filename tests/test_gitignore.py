@@ -0,0 +1,43 @@
+from app.repo_files import is_ignored, parse_gitignore
+
+
+def ignored(patterns: str, path: str, is_dir: bool = False, base: str = "") -> bool:
+    return is_ignored(path, is_dir, parse_gitignore(patterns, base))
+
+
+def test_star_does_not_cross_directories():
+    assert ignored("docs/*.md", "docs/index.md")
+    assert not ignored("docs/*.md", "docs/api/index.md")
+    assert not ignored("a/?/c", "a/b/x/c")
+
+
+def test_unanchored_pattern_matches_at_any_depth():
+    assert ignored("*.log", "debug.log")
+    assert ignored("*.log", "logs/app/debug.log")
+    assert ignored("foo/", "src/foo", is_dir=True)
+    assert not ignored("foo/", "src/foo", is_dir=False)
+
+
+def test_leading_slash_anchors_to_the_gitignore_directory():
+    assert ignored("/build", "build", is_dir=True)
+    assert not ignored("/build", "src/build", is_dir=True)
+    assert ignored("/build", "pkg/build", is_dir=True, base="pkg")
+
+
+def test_double_star_matches_zero_or_more_directories():
+    assert ignored("a/**/b", "a/b")
+    assert ignored("a/**/b", "a/x/b")
+    assert ignored("a/**/b", "a/x/y/b")
+    assert not ignored("a/**/b", "a/xb")
+    assert ignored("**/cache", "cache", is_dir=True)
+    assert ignored("**/cache", "x/y/cache", is_dir=True)
+    assert ignored("out/**", "out/a/b.txt")
+    assert not ignored("out/**", "out")
+
+
+def test_character_classes_and_negation():
+    assert ignored("file[0-9].txt", "file3.txt")
+    assert not ignored("file[!0-9].txt", "file3.txt")
+    assert ignored("file[!0-9].txt", "fileA.txt")
+    assert not ignored("a[/]b", "a/b")
+    assert not ignored("*.log\n!keep.log", "keep.log")
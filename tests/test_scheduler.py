@@ -0,0 +1,56 @@
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+import app.scheduler as scheduler_module
+from app.rag_pipeline import generate_answer
+from app.scheduler import TokenBucketScheduler, call_openai
+
+
+def rate_limit_error(retry_after: str) -> openai.RateLimitError:
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(429, headers={"retry-after": retry_after}, request=request)
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    scheduler = TokenBucketScheduler(0, 0)
+    monkeypatch.setattr(scheduler_module, "scheduler", scheduler)
+    return scheduler
+
+
+def test_retry_after_past_deadline_raises_timeout(scheduler):
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        raise rate_limit_error("5")
+
+    with pytest.raises(TimeoutError) as raised:
+        call_openai(create, 10, deadline=time.monotonic() + 1.0)
+    assert isinstance(raised.value.__cause__, openai.RateLimitError)
+    assert len(calls) == 1
+    # The queue still waits out the limit for everyone else
+    assert scheduler.get_stats()["paused_seconds"] > 4
+
+
+def test_rate_limit_past_deadline_returns_chunks(scheduler, monkeypatch):
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        raise rate_limit_error("5")
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    monkeypatch.setattr("app.utils.openai_client", client)
+
+    chunks = [{"content": "def f(): pass", "file": "a.py", "start_line": 1, "end_line": 1}]
+    start_time = time.monotonic()
+    result = generate_answer("What does f do?", chunks, deadline=1.0, hedge=False)
+    assert result == {"answer": None, "generation_timed_out": True, "chunks": chunks}
+    assert len(calls) == 1
+    assert time.monotonic() - start_time < 1.0
@@ -0,0 +1,34 @@
+import app.token_budget as token_budget
+from app.file_reader import read_file_range
+from app.token_budget import fit_file
+
+
+def test_single_long_line_continues_by_bytes(tmp_path, monkeypatch):
+    # One long line, as in minified code, with the token count estimated from the characters
+    monkeypatch.setattr(token_budget, "count_tokens", lambda text: len(text) // 4 + 1)
+    path = tmp_path / "bundle.min.js"
+    path.write_text("var a=1;" * 20000)
+
+    result = fit_file(read_file_range(str(path), start_line=1), max_tokens=1000)
+    assert result["truncated"]
+    assert "next_start_line" not in result and "omitted_lines" not in result
+    returned = len(result["content"].encode("utf-8"))
+    assert 0 < returned < 160000
+    assert result["next_byte_offset"] == returned
+    assert result["omitted_bytes"] == [returned, 160000]
+
+    # Following the cursor reads on through the line instead of returning the same part again
+    following = fit_file(read_file_range(str(path), byte_offset=result["next_byte_offset"]), max_tokens=1000)
+    assert following["next_byte_offset"] == returned + len(following["content"].encode("utf-8"))
+    assert following["next_byte_offset"] > result["next_byte_offset"]
+
+
+def test_lines_continue_by_line(tmp_path, monkeypatch):
+    monkeypatch.setattr(token_budget, "count_tokens", lambda text: len(text) // 4 + 1)
+    path = tmp_path / "module.py"
+    path.write_text("".join(f"line_{i} = {i}\n" for i in range(1, 2001)))
+
+    result = fit_file(read_file_range(str(path), start_line=11), max_tokens=1000)
+    assert result["next_start_line"] == result["omitted_lines"][0]
+    assert result["omitted_lines"][0] > 11
+    assert result["omitted_lines"][1] < 2000
@@ -0,0 +1,109 @@
+import os
+
+import pytest
+
+import app.repo_files as repo_files
+import app.search as search
+import app.trigram_index as trigram_index
+from app.search import compile_query, search_repo
+from app.trigram_index import query_plan
+
+FILES = {
+    "pkg/reader.py": "class Reader:\n    def read_config(self):\n        return load('settings.json')\n",
+    "pkg/server.py": "import http\n\ndef serve_forever(port):\n    # TODO handle shutdown\n    return port\n",
+    "pkg/render.py": "def Render_Page(theme):\n    return theme.upper()\n",
+    "docs/notes.md": "Colour and color are both used here.\nfoobarbaz\n",
+    "data.bin": "abc\0serve_forever",
+}
+
+QUERIES = [
+    # (query, regex, case_sensitive)
+    ("read_config", False, True),
+    ("serve_forever", False, True),
+    ("render_page", False, False),
+    ("RENDER_PAGE", False, True),
+    ("(?i)render_page", True, True),
+    ("colou?r", True, True),
+    ("(Colour|theme)", True, True),
+    ("(handle|x) shutdown", True, True),
+    ("foo|ba", True, True),
+    ("(abc)?settings", True, True),
+    ("foo(bar)+baz", True, True),
+    ("foo(qux)*barbaz", True, True),
+    ("(?=serve)serve_forever", True, True),
+    ("(?<!def )serve_forever", True, True),
+    ("(?!Reader)class", True, True),
+    ("nowhere_to_be_found", False, True),
+    ("a.c", True, True),
+]
+
+
+@pytest.mark.parametrize("query, regex, case_sensitive, plan", [
+    ("read_config", False, True, [b"read_config"]),
+    ("ab", False, True, []),
+    ("Render_Page", False, False, [b"Render_Page"]),
+    ("(?i)Render_Page", True, True, [b"Render_Page"]),
+    ("foo|bar", True, True, [("or", [[b"foo"], [b"bar"]])]),
+    # A branch that requires nothing lets every file match
+    ("foo|ba", True, True, []),
+    ("(foo|)barbaz", True, True, [b"barbaz"]),
+    ("(abc)?settings", True, True, [b"settings"]),
+    ("foo(qux)*baz", True, True, [b"foo", b"baz"]),
+    ("x(abcd)+", True, True, [b"abcd"]),
+    ("(?=abc)xyz", True, True, [b"xyz"]),
+    ("(?!abc)xyz", True, True, [b"xyz"]),
+    ("(?<!abc)xyz", True, True, [b"xyz"]),
+    ("a.c", True, True, []),
+])
+def test_query_plan(query, regex, case_sensitive, plan):
+    assert query_plan(compile_query(query, regex, case_sensitive)) == plan
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    monkeypatch.setattr(trigram_index, "TRIGRAM_INDEX_DIR", str(tmp_path / "indexes"))
+    monkeypatch.setattr(repo_files, "SNAPSHOT_TTL", 0)
+    monkeypatch.setattr(repo_files.file_cache, "ttl", 0)
+    root = tmp_path / "repo"
+    for rel_path, content in FILES.items():
+        (root / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (root / rel_path).write_text(content)
+    return root
+
+
+def search_both(monkeypatch, root, query, regex=False, case_sensitive=True):
+    """The matches of a search without, then with the trigram index."""
+    results = []
+    for enabled in (False, True):
+        monkeypatch.setattr(search, "TRIGRAM_INDEX_ENABLED", enabled)
+        results.append(search_repo(str(root), query, regex, case_sensitive)["matches"])
+    return results
+
+
+@pytest.mark.parametrize("query, regex, case_sensitive", QUERIES)
+def test_index_finds_what_a_full_scan_finds(repo, monkeypatch, query, regex, case_sensitive):
+    scanned, indexed = search_both(monkeypatch, repo, query, regex, case_sensitive)
+    assert indexed == scanned
+
+
+def test_files_added_and_removed_between_searches(repo, monkeypatch):
+    search_both(monkeypatch, repo, "serve_forever")
+
+    (repo / "pkg" / "client.py").write_text("def serve_forever_client():\n    pass\n")
+    os.remove(repo / "pkg" / "server.py")
+    scanned, indexed = search_both(monkeypatch, repo, "serve_forever")
+    assert [match["file"] for match in indexed] == ["pkg/client.py"]
+    assert indexed == scanned
+
+
+def test_file_edited_in_place(repo, monkeypatch):
+    monkeypatch.setattr(trigram_index, "TRIGRAM_REFRESH_SECONDS", 0)
+    search_both(monkeypatch, repo, "serve_forever")
+
+    # Appending keeps the directory's mtime, so only re-statting the file shows the change
+    with open(repo / "pkg" / "render.py", "a") as f:
+        f.write("def serve_forever_too():\n    pass\n")
+    os.utime(repo / "pkg" / "render.py", ns=(1, 1))
+    scanned, indexed = search_both(monkeypatch, repo, "serve_forever_too")
+    assert [match["file"] for match in indexed] == ["pkg/render.py"]
+    assert indexed == scanned